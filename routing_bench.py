@@ -0,0 +1,156 @@
+# Benchmark of the intent placement at scale: the controller is given a generated set of intents and middle switch paths
+# (no switches are needed, the messages are sent to null connections which count their bytes) and the routing cycles are timed:
+#    - the first cycle, which places all the intents,
+#    - cycles after the delays of all paths have changed, which place again the intents whose candidate paths changed,
+#    - a cycle without any change.
+# The placement alone (heap of the paths, see PathHeap) is also compared with a linear scan of the candidate paths
+# of every intent, as intent_routing() did before.
+# e.g. (with the POX directory in PYTHONPATH):
+#    python2 routing_bench.py --intents 1000 10000 20000 --paths 3 12 36 --solver mcf
+
+import sys
+import os
+import random
+import argparse
+import timeit
+from bisect import bisect_left
+
+from pox.core import core
+
+import routing_controller as rc
+
+
+class NullConnection(object):
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = 0  # [bytes]
+
+    def send(self, data):
+        self.sent += len(data if isinstance(data, bytes) else data.pack())
+
+
+class NullNexus(object):
+    def __init__(self):
+        self.connections = {1: NullConnection(1), 5: NullConnection(5)}
+
+    def addListenerByName(self, name, handler):
+        pass
+
+    def getConnection(self, dpid):
+        return self.connections.get(dpid)
+
+
+def setup(n_intents, n_paths, seed):
+    # n_paths middle switches between s1 and s5, and n_intents intents between the hosts of s1 and the hosts of s5
+    random.seed(seed)
+    side = int(n_intents ** 0.5) + 1
+    rc.hosts = {}
+    for i in range(side):
+        rc.hosts['a%d' % i] = ("10.1.%d.%d" % (i // 250, i % 250 + 1), rc.ingress_switch, i + 1)
+        rc.hosts['b%d' % i] = ("10.2.%d.%d" % (i // 250, i % 250 + 1), rc.egress_switch, i + 1)
+    rc.measured_paths = ['p%d' % i for i in range(n_paths)]
+    rc.path_ports = dict([(path, (side + 1 + i, side + 1 + i)) for i, path in enumerate(rc.measured_paths)])
+    rc.link_delay = dict([(path, rc.DelayHistory()) for path in rc.measured_paths])
+    rc.path_load = dict([(path, rc.CounterRate()) for path in rc.measured_paths])
+    rc.current_flows = dict([(path, 0) for path in rc.measured_paths])
+    rc.current_routing.clear()
+    rc.route_candidates.clear()
+    rc.other_intents.clear()
+    rc.forward_rates.clear()
+    rc.reverse_rates.clear()
+    rc.current_delays = []
+    rc.intents = []
+    for n in range(n_intents):
+        rc.intents.append({'source': 'a%d' % (n // side),
+                           'destination': 'b%d' % (n % side),
+                           'delay': float(random.randrange(5, 255, 5))})
+    rc.compile_tables()
+    rc.s1_dpid = 1
+    rc.s5_dpid = 5
+    rc.connected_switches.update([1, 5])
+    for connection in core.openflow.connections.values():
+        connection.sent = 0
+    change_delays()
+
+
+def change_delays():
+    for path in rc.measured_paths:
+        rc.link_delay[path].add(random.uniform(1, 250))
+
+
+def timed(function):
+    started = timeit.default_timer()
+    function()
+    elapsed = timeit.default_timer() - started
+    rc.pending_barriers.clear()  # the null connections do not answer the barriers of the transactions
+    return elapsed
+
+
+def linear_placement(intents, delays, flows):
+    # placement with a linear scan of the candidates of every intent (paths in the order of decreasing delay)
+    for intent in sorted(intents, key=lambda intent: intent['delay']):
+        candidates = [delay['path'] for delay in delays if delay['delay'] < intent['delay']]
+        if candidates == []:
+            candidates = [delays[-1]['path']]
+        flows[rc.least_loaded_path(candidates, flows)] += 1
+
+
+def heap_placement(intents, delays, flows):
+    # the placement of intent_routing(): the paths enter a heap as the delay bounds grow
+    ascending = [delay['path'] for delay in reversed(delays)]
+    ascending_delays = [delay['delay'] for delay in reversed(delays)]
+    heap = rc.PathHeap(dict([(delay['path'], delay['delay']) for delay in delays]), flows)
+    pushed = 0
+    for intent in sorted(intents, key=lambda intent: intent['delay']):
+        k = max(1, bisect_left(ascending_delays, intent['delay']))
+        while pushed < k:
+            heap.push(ascending[pushed])
+            pushed += 1
+        path = heap.top()
+        flows[path] += 1
+        heap.update(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the intent placement of routing_controller")
+    parser.add_argument('--intents', type=int, nargs='+', default=[1000, 10000, 20000], help="numbers of intents")
+    parser.add_argument('--paths', type=int, nargs='+', default=[3, 12, 36], help="numbers of paths")
+    parser.add_argument('--cycles', type=int, default=5, help="routing cycles after delay changes (default 5)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--solver', choices=['greedy', 'mcf'], default='greedy', help="placement solver (default greedy)")
+    parser.add_argument('--solver_budget', type=float, default=50.0, help="time budget of the mcf solver [ms] (default 50)")
+    args = parser.parse_args()
+    rc.solver_mode = args.solver
+    rc.solver_time_budget = args.solver_budget / 1000
+
+    core.register('openflow', NullNexus())
+
+    print "%8s %6s %12s %14s %12s %14s %14s %10s" % ("intents", "paths", "first [ms]", "changed [ms]", "steady [ms]",
+                                                     "heap [us/int]", "scan [us/int]", "sent")
+    for n_intents in args.intents:
+        for n_paths in args.paths:
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                setup(n_intents, n_paths, args.seed)
+                first = timed(rc.intent_routing)
+                changed = 0.0
+                for cycle in range(args.cycles):
+                    change_delays()
+                    changed += timed(rc.intent_routing)
+                steady = timed(rc.intent_routing)
+
+                delays = rc.current_delays
+                heap = timed(lambda: heap_placement(rc.intents, delays, dict([(path, 0) for path in rc.measured_paths])))
+                scan = timed(lambda: linear_placement(rc.intents, delays, dict([(path, 0) for path in rc.measured_paths])))
+                sent = sum([connection.sent for connection in core.openflow.connections.values()])
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print "%8d %6d %12.1f %14.1f %12.1f %14.2f %14.2f %10s" % (
+                n_intents, n_paths, first * 1000, changed / max(1, args.cycles) * 1000, steady * 1000,
+                heap / n_intents * 1e6, scan / n_intents * 1e6, "%d kB" % (sent // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,15 @@
 # Overall operation of the controller:
 #    - default routing is set in all switches on the reception of packet_in messages form the switch,
 #    - then the routing for (h1-h4) pair in switch s1 is changed every one second in a round-robin manner to load balance the traffic through switches s3, s4, s2.
+#    - the delays of S1-S2, S1-S3 and S1-S4 links are measured with probe packets either one link per tick (round robin)
+#      or all links in the same tick (concurrent probing); the intents are routed over the measured paths.
+#    - the paths between s1 and s5 are the k shortest paths of the topology model (the diamond, or the links found by
+#      openflow.discovery), each of them named after its interior switches (e.g. 's2' in the diamond).
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
-from pox.lib.util import dpidToStr
+import pox.openflow.of_01 as of_01
+from pox.lib.util import dpidToStr, str_to_bool
 from pox.lib.addresses import IPAddr, EthAddr
 from pox.lib.packet.arp import arp
 from pox.lib.packet.ethernet import ethernet, ETHER_BROADCAST
@@ -16,58 +21,504 @@ from pox.lib.packet.packet_utils import *
 import pox.lib.packet as pkt
 from pox.lib.recoco import Timer
 import time
+import heapq
+import zlib
+from bisect import bisect_left
+from timeit import default_timer
 from operator import itemgetter
+from collections import OrderedDict
 
-# S1-S2 link measurements
-s1s2_start_time = 0.0
-s1s2_sent_time2 = 0.0
-s1s2_OWD2 = 0.0
-s1s2_delay_link = 0.0
 
-# S1-S3 link measurements
-s1s3_start_time = 0.0
-s1s3_sent_time2 = 0.0
-s1s3_OWD2 = 0.0
-s1s3_delay_link = 0.0
+class DelayHistory(object):
+    """
+    DelayHistory keeps the last delay samples [ms] of one link in a fixed-size ring buffer (the buffer is allocated once,
+    so it does not grow however long the controller runs) and provides the estimators routing can be told to use:
+    the last sample, the EWMA of all samples, and the median or a percentile of the buffered samples; it also smooths the samples
+    with Holt's linear trend method (level and trend per second, the samples may come at irregular times) to forecast the delay
+    """
+
+    def __init__(self, size=16, alpha=0.25, level_alpha=0.5, trend_beta=0.3):
+        self.samples = [0.0] * size
+        self.size = size
+        self.count = 0  # number of valid samples in the buffer (up to size)
+        self.index = 0  # position of the next sample in the buffer
+        self.alpha = alpha  # weight of a new sample in the EWMA
+        self.last = 0.0
+        self.ewma = None
+        self.level_alpha = level_alpha  # weight of a new sample in the level of the trend model
+        self.trend_beta = trend_beta  # weight of a new slope in the trend
+        self.level = None
+        self.trend = 0.0  # [ms/s]
+        self.variance = 0.0  # EWMA of the squared errors of the one-step forecasts
+        self.time = None  # time of the last sample
+
+    def add(self, sample, now=None):
+        self.samples[self.index] = sample
+        self.index = (self.index + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        self.last = sample
+        if self.ewma is None:
+            self.ewma = float(sample)
+        else:
+            self.ewma += self.alpha * (sample - self.ewma)
+        if now is None:
+            now = time.time()
+        if self.level is None:
+            self.level = float(sample)
+        else:
+            interval = max(now - self.time, 0.001)
+            predicted = self.level + self.trend * interval
+            self.variance += self.alpha * ((sample - predicted) ** 2 - self.variance)
+            level = predicted + self.level_alpha * (sample - predicted)
+            self.trend += self.trend_beta * ((level - self.level) / interval - self.trend)
+            self.level = level
+        self.time = now
+
+    def forecast(self, horizon, z=0.0):
+        # delay expected horizon [s] after the last sample, z standard deviations of the forecast errors above the trend
+        if self.level is None:
+            return 0.0
+        return max(0.0, self.level + self.trend * horizon + z * self.variance ** 0.5)
+
+    def percentile(self, p):
+        # percentile of the buffered samples with linear interpolation between the closest ranks
+        if self.count == 0:
+            return 0.0
+        ordered = sorted(self.samples[:self.count])
+        rank = p / 100.0 * (self.count - 1)
+        low = int(rank)
+        high = min(low + 1, self.count - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+    def median(self):
+        return self.percentile(50)
+
+    def stddev(self):
+        # standard deviation of the buffered samples
+        if self.count < 2:
+            return 0.0
+        samples = self.samples[:self.count]
+        mean = sum(samples) / float(self.count)
+        return (sum([(sample - mean) ** 2 for sample in samples]) / self.count) ** 0.5
+
+    def estimate(self, estimator, p=90):
+        if estimator == 'ewma':
+            return self.ewma if self.ewma is not None else 0.0
+        elif estimator == 'median':
+            return self.median()
+        elif estimator == 'percentile':
+            return self.percentile(p)
+        return self.last
+
+
+class CounterRate(object):
+    """
+    CounterRate turns byte and packet counters read at given times into bit and packet rates; it measures the load of a path
+    from the tx counters of the s1 port towards it (port stats) and the rate of a flow from the counters of its entry (flow stats);
+    the rates of consecutive readings are smoothed with an EWMA
+    """
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha  # weight of a new rate in the EWMA
+        self.tx_bytes = None
+        self.tx_packets = None
+        self.time = None
+        self.bps = 0.0
+        self.pps = 0.0
+
+    def update(self, tx_bytes, tx_packets, now):
+        if self.time is not None and now > self.time and tx_bytes >= self.tx_bytes and tx_packets >= self.tx_packets:
+            interval = now - self.time
+            self.bps += self.alpha * ((tx_bytes - self.tx_bytes) * 8 / interval - self.bps)
+            self.pps += self.alpha * ((tx_packets - self.tx_packets) / interval - self.pps)
+        # a counter going back (e.g. the switch reconnected) restarts the measurement from the new values
+        self.tx_bytes = tx_bytes
+        self.tx_packets = tx_packets
+        self.time = now
+
+
+class PathHeap(object):
+    """
+    PathHeap orders the candidate paths of the placement by their load and delay, so the least loaded path (the lowest delay
+    one among equally loaded paths) is found in O(log P); the load is the number of flows, or the projected load [bit/s]
+    with the number of flows breaking the ties; a path whose load changes is pushed again and its stale entries are
+    dropped when they reach the top
+    """
+
+    def __init__(self, delays, flows, loads=None):
+        self.heap = []
+        self.delays = delays  # path -> delay
+        self.flows = flows
+        self.loads = loads
+        self.paths = set()  # paths pushed so far
+
+    def key(self, path):
+        if self.loads is None:
+            return self.flows[path]
+        return (self.loads[path], self.flows[path])
+
+    def push(self, path):
+        self.paths.add(path)
+        heapq.heappush(self.heap, (self.key(path), self.delays[path], path))
+
+    def update(self, path):
+        # called after the load of the path has changed; the top entry (usually the path just chosen) is replaced in place
+        if self.heap and self.heap[0][2] == path:
+            heapq.heapreplace(self.heap, (self.key(path), self.delays[path], path))
+        elif path in self.paths:
+            heapq.heappush(self.heap, (self.key(path), self.delays[path], path))
+
+    def top(self):
+        while self.heap:
+            key, delay, path = self.heap[0]
+            if key == self.key(path):
+                return path
+            heapq.heappop(self.heap)
+        return None
+
+
+class TokenBucket(object):
+    """
+    TokenBucket limits the flow mods and packet-outs sent to a switch to rate per second with bursts of burst messages;
+    the messages above the limit wait in a queue in the order of (priority, arrival), and a queued flow mod is dropped
+    when a newer flow mod of the same entry is sent or queued, unless it is a delete (see send_messages())
+    """
 
-# S1-S4 link measurements
-s1s4_start_time = 0.0
-s1s4_sent_time2 = 0.0
-s1s4_OWD2 = 0.0
-s1s4_delay_link = 0.0
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time = time.time()
+        self.queue = []  # heap of [priority, sequence, message, entry key of a flow mod or None]
+        self.queued = {}  # entry key -> queue item of the last queued flow mod of the entry
+        self.deletes = {}  # entry key -> queue item of the last queued delete of the entry
+        self.sequence = 0
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+    def take(self, count):
+        # a batch larger than the burst passes with a full bucket, which then stays in debt until it is refilled
+        if self.tokens >= min(count, self.burst):
+            self.tokens -= count
+            return True
+        return False
+
+    def supersede(self, key, delete=False):
+        # a queued delete is only dropped by a newer delete: a modify sent after it changes the actions of an entry which
+        # it did not remove, so the later flow mods of the entry are queued behind it instead
+        pending = self.deletes.get(key)
+        if delete and pending is not None:
+            del self.deletes[key]
+            pending[2] = None  # removed from the heap when it comes to the top
+            pending = None
+        item = self.queued.get(key)
+        if item is not None and item is not pending:
+            del self.queued[key]
+            item[2] = None
+
+    def push(self, priority, msg, key, delete=False):
+        if key is not None:
+            self.supersede(key, delete)
+            pending = self.deletes.get(key)
+            if pending is not None and pending[0] > priority:
+                # the delete moves up to the priority of the flow mod queued after it, keeping its place by sequence
+                promoted = [priority, pending[1], pending[2], key]
+                pending[2] = None
+                heapq.heappush(self.queue, promoted)
+                self.deletes[key] = promoted
+                if self.queued.get(key) is pending:
+                    self.queued[key] = promoted
+        self.sequence += 1
+        item = [priority, self.sequence, msg, key]
+        heapq.heappush(self.queue, item)
+        if key is not None:
+            self.queued[key] = item
+            if delete:
+                self.deletes[key] = item
+
+    def top(self):
+        # the first live item of the queue, None if it is empty
+        while self.queue and self.queue[0][2] is None:
+            heapq.heappop(self.queue)
+        return self.queue[0] if self.queue else None
+
+    def pop(self):
+        item = heapq.heappop(self.queue)
+        if item[3] is not None:
+            if self.queued.get(item[3]) is item:
+                del self.queued[item[3]]
+            if self.deletes.get(item[3]) is item:
+                del self.deletes[item[3]]
+        return item[2]
+
+
+class FlowModTransaction(object):
+    """
+    FlowModTransaction collects the flow mods produced by one routing pass; commit() writes the messages of each switch
+    in a single send() ended with a barrier request, and the transaction is complete when every switch has answered
+    its barrier (i.e. has applied all the flow mods sent before it)
+    """
+
+    count = 0  # number of the transactions created so far, used to name them
+
+    def __init__(self, name, priority=None):
+        FlowModTransaction.count += 1
+        self.name = "%s#%d" % (name, FlowModTransaction.count)
+        self.priority = PRIORITY_BULK if priority is None else priority  # queue priority under the rate limit
+        self.messages = {}  # messages to be sent, indexed by dpid
+        self.barriers = set()  # (dpid, xid) of the barrier requests not answered yet
+        self.commit_time = None
+        self.complete_time = None
+
+    def add(self, dpid, msg):
+        # msg is an OpenFlow message object or an already packed message
+        self.messages.setdefault(dpid, []).append(msg)
+
+    def commit(self):
+        if self.messages == {}:
+            return
+        expire_transactions()
+        self.commit_time = time.time()
+        for dpid, msgs in self.messages.iteritems():
+            connection = core.openflow.getConnection(dpid)
+            if connection is None:
+                log.warning("Transaction %s: switch %s is not connected, %d flow mods dropped", self.name, dpidToStr(dpid), len(msgs))
+                continue
+            barrier = of.ofp_barrier_request()
+            send_messages(dpid, [msg if isinstance(msg, bytes) else msg.pack() for msg in msgs] + [barrier.pack()], self.priority)
+            self.barriers.add((dpid, barrier.xid))
+            pending_barriers[(dpid, barrier.xid)] = self
+        if self.barriers == set():
+            self.complete_time = time.time()
+
+    def barrier_replied(self, dpid, xid):
+        self.barriers.discard((dpid, xid))
+        if self.barriers == set():
+            self.complete_time = time.time()
+            print "Transaction", self.name, "completed in", round((self.complete_time - self.commit_time) * 1000, 1), "[ms];", \
+                sum([len(msgs) for msgs in self.messages.itervalues()]), "flow mods in", len(self.messages), "switches"
+
+
+# S1-S2, S1-S3 and S1-S4 link measurements; the path through switch sX is measured on link S1-SX
+link_sent_time2 = {'s2': 0.0, 's3': 0.0, 's4': 0.0}
+link_OWD2 = {'s2': 0.0, 's3': 0.0, 's4': 0.0}
+link_delay = {'s2': DelayHistory(), 's3': DelayHistory(), 's4': DelayHistory()}
+
+# delay of a path (see launch()): 'first_hop' measures the S1-SX link only; 'oneway' and 'rtt' probe every link of the paths
+# in both directions (see measure_segments()) and give the routing the sum of the links from s1 to s5, or of the round trip
+path_delay_mode = 'first_hop'
+segment_ids = {}  # (switch, neighbour switch) -> id carried in the probes of the link
+segment_probes = {}  # probe id -> (switch, neighbour switch)
+segment_delay = {}  # (switch, neighbour switch) -> last delay of the link in that direction [ms] (only S1-SX with 'first_hop')
+pending_segments = {}  # path -> links of the path whose probes of the current round have not come back yet
+path_delays = {}  # path -> (one-way, round trip) delay [ms] of the last complete round, printed in every routing cycle
+stats_sent_time = {}  # DPID -> sending time of the port stats request measuring its control channel [ms*10]
+switch_owd = {}  # DPID -> one-way delay of its control channel from the port stats [ms*10]
+
+# transactions waiting for barrier replies, indexed by (dpid, xid) of the barrier request
+pending_barriers = {}
+transaction_timeout = 5.0  # [s] after which a transaction without all barrier replies is reported and forgotten
+
+# rate limit of the messages to each switch (see TokenBucket and launch()): at most message_rate_limit flow mods and
+# packet-outs per second with bursts of message_burst_size, 0: no limit; the messages above the limit are queued by priority
+message_rate_limit = 0.0
+message_burst_size = 100
+message_buckets = {}  # DPID -> TokenBucket
+PRIORITY_PROBE = 0  # sent at once (their timestamps are taken as they are sent), they only use up tokens
+PRIORITY_REROUTE = 1  # routing, failover and topology changes
+PRIORITY_BULK = 2  # installs triggered by packet-ins, static rules and packet-outs
+
+# packet-in admission: the packet-ins of a (source, destination) pair whose flow entries are being installed are dropped
+flow_installs = {}  # (source, destination) -> FlowModTransaction installing the entries of the pair
+coalesced_packet_ins = 0
+
+# estimator of the link delay used by the routing: 'last', 'ewma', 'median' or 'percentile' (see launch())
+delay_estimator = 'last'
+delay_percentile = 90
+
+# forecast mode (see get_link_delay() and launch()): the routing takes the higher of the estimated delay and the upper bound
+# (forecast_z standard deviations) of the trend forecast one routing period ahead, so that an intent leaves a path before
+# its delay bound is broken; forecast_alpha and forecast_beta weight the level and the trend of the forecast
+forecast_mode = False
+forecast_alpha = 0.5
+forecast_beta = 0.3
+forecast_z = 1.0
 
 OWD1_send_time = 0.0
 OWD1_receive_time = 0.0
 
+# control channel latency subtracted from the probe delays (see launch()):
+#    - 'portstats' takes half of the round trip of the port stats requests sent with the probes,
+#    - 'echo' takes half of the smoothed round trip of echo requests, the port stats are then polled every port_stats_interval
+#      for the load of the paths only.
+latency_mode = 'portstats'
+switch_rtt = {}  # dpid -> DelayHistory of the echo round trip times [ms*10]
+port_stats_interval = 5.0
+port_stats_time = 0.0  # time of the last port stats poll of s1 in the echo mode
+
 log = core.getLogger()
 
+# DPIDs of the edge switches: s1 (ingress_switch) and s5 (egress_switch)
 s1_dpid = 0
-s2_dpid = 0
-s3_dpid = 0
-s4_dpid = 0
 s5_dpid = 0
 
-s1_p4 = 0
-s1_p5 = 0
-s1_p6 = 0
-pre_s1_p4 = 0
-pre_s1_p5 = 0
-pre_s1_p6 = 0
+# topology model (see update_paths() and launch()): 'diamond' takes the links of the lab topology, 'discovery' the links
+# reported by openflow.discovery; the switches are identified by their DPIDs, and named only in the printouts and in the
+# names of the paths (see switch_name()). The edges stay those of the lab, s1 and s5 (Mininet gives sN the DPID N),
+# as the host table attaches the hosts to them
+topology_mode = 'diamond'
+ingress_switch = 1
+egress_switch = 5
+diamond_links = [(1, 4, 2, 1), (1, 5, 3, 1), (1, 6, 4, 1),
+                 (2, 2, 5, 1), (3, 2, 5, 2), (4, 2, 5, 3)]  # (DPID, port, DPID, port)
+adjacency = {}  # DPID -> {neighbour DPID: output port towards it}
+connected_switches = set()  # DPIDs of the switches which have connected
+path_hops = {}  # path -> switches of the path from ingress_switch to egress_switch
+path_hop_ports = {}  # path -> (interior switch, output port towards s5, output port towards s1) of each interior switch
+max_paths = 3  # k of the k shortest paths
+default_link_delay = 1.0  # [ms] weight of the links without a measured delay
+path_change_margin = 10.0  # [ms] by which the measured delays have to favour a new set of paths before it replaces the current one
+timer_started = False
+packet_in_handlers = {}  # (DPID, EtherType) -> handler of the PACKET_IN messages (see register_packet_in_handlers())
+
+# fast reroute (see fail_over()): a port which goes down (PortStatus), a lost link (discovery) or a disconnected switch
+# (port None) takes the paths through it out of the routing at once; with backup_mode a backup path is kept for each route
+down_ports = set()  # (switch, port) which are down
+down_paths = set()  # paths through a port in down_ports
+backup_mode = False
+backup_paths = {}  # (source, destination) -> backup path of the route (see compute_backup_paths())
+
+# load of the paths measured on the s1 ports towards them (see CounterRate)
+path_load = {'s2': CounterRate(), 's3': CounterRate(), 's4': CounterRate()}
+
+# rates of the routed flows measured from the flow stats of s1 (forward direction) and s5 (reverse direction),
+# indexed by (source, destination) of the route (see CounterRate)
+forward_rates = {}
+reverse_rates = {}
+
+# placement of the intents on their candidate paths: 'flows' balances the number of flows, 'load' the measured load (see launch())
+placement_mode = 'flows'
+min_flow_rate = 100000.0  # [bit/s] rate assumed for a flow by the 'load' placement when less has been measured
 
 start_time = 0
 turn = 0
+probe_tick = 0
+
+# probing configuration (see launch()):
+#    - 'round_robin' probes one path per tick and runs intent_routing() every fourth tick,
+#    - 'concurrent' probes all paths in every tick and runs intent_routing() every routing_interval seconds,
+#    - 'adaptive' probes each path with its own period (see adapt_probe_period()) and routes as 'concurrent' does.
+probe_mode = 'round_robin'
+probe_interval = 1.0
+routing_interval = 4.0
+routing_ticks = 4
+
+# adaptive probing: the probe period of a path moves from max_probe_interval down to probe_interval as the delay samples
+# of the path vary more (up to probe_jitter_limit of standard deviation) or its delay gets closer to the delay bound of an intent
+# (down to probe_slack_limit); probe_rate_limit limits the probes of all paths together; path_probe_limits overrides both
+# periods for single paths
+max_probe_interval = 8.0
+path_probe_limits = {}  # path -> (minimum, maximum) probe period [s]
+probe_rate_limit = 0.0  # [probes/s], 0: no limit
+probe_jitter_limit = 5.0  # [ms]
+probe_slack_limit = 10.0  # [ms]
+path_probe_period = {}  # path -> probe period [s]
+last_probe_time = {}  # path -> time of the last probe
+next_probe_time = {}  # path -> time at which the path is probed next
+probe_credit = 0.0  # probes allowed by probe_rate_limit and not used yet
+
+# measured paths and the id carried in their probes (the paths are replaced by set_paths())
+measured_paths = ['s2', 's3', 's4']
+history_size = 16
+history_alpha = 0.25
+probe_ids = {'s2': 1, 's3': 2, 's4': 3}
+probe_paths = {1: 's2', 2: 's3', 3: 's4'}
 
 default_route_s1 = 4
 default_route_s5 = 1
 
+# host table: host -> (IP address, DPID of the edge switch, port of the edge switch)
+hosts = {'h1': ("10.0.0.1", ingress_switch, 1),
+         'h2': ("10.0.0.2", ingress_switch, 2),
+         'h3': ("10.0.0.3", ingress_switch, 3),
+         'h4': ("10.0.0.4", egress_switch, 4),
+         'h5': ("10.0.0.5", egress_switch, 5),
+         'h6': ("10.0.0.6", egress_switch, 6)}
+# path table: path -> (output port of s1 towards the path, output port of s5 towards the path)
+path_ports = {'s2': (4, 1), 's3': (5, 2), 's4': (6, 3)}
+
+# lookup tables compiled from the host table by compile_tables()
+host_ips = {}  # host -> IPAddr
+ip_hosts = {}  # IPAddr -> host
+raw_ip_hosts = {}  # IP address in network byte order (4 bytes) -> host
+edge_hosts = {}  # DPID of an edge switch -> hosts attached to it
+
+# caches of packed messages: the flow mods of the routes indexed by (source, destination, path, command, idle timeout),
+# the static rules of the switches and the output actions of packet_out messages indexed by port
+flow_mod_cache = {}
+host_rule_cache = {}
+transit_rules = []
+output_actions = {}
+probe_frames = {}  # PACKET_OUT messages of the probes indexed by path, only their timestamps change (see send_probe())
+
+# shadow flow tables: the entries each switch holds as far as the controller knows, so that a flow mod writing an entry
+# which is in place already is not sent (see send_flow_mod()); DPID -> {(in_port, dl_type, nw_src, nw_dst, priority):
+# (idle timeout, hard timeout, output ports)}, the key continues with nw_proto, tp_src and tp_dst; after a (re)connection the table is completed from the flow stats of the switch
+flow_tables = {}
+reconcile_xids = {}  # DPID -> xid of the flow stats request reconciling the shadow table of the switch
+redundant_flow_mods = 0  # flow mods which have not been sent, as their entries were in place
+
+# proactive mode: the static rules are pushed to each switch on ConnectionUp instead of on every packet_in (see launch())
+proactive_mode = False
+
+# ARP at the edge switches (see edge_arp() and launch()): 'forward' sends every ARP packet on towards its target host,
+# 'proxy' answers the requests for hosts with a learned binding from the controller, 'proactive' also installs rules
+# forwarding the ARP packets to the local hosts in the edge switches
+arp_mode = 'forward'
+arp_table = {}  # IPAddr -> EthAddr of the hosts, learned from their ARP packets at their edge switch
+
 current_delays = []
 current_flows = {'s2': 0, 's3': 0, 's4': 0}
-current_routing = []
-# example routing: {'intent': intent, 'path': 4}
+current_routing = {}
+# routing table indexed by (source, destination), e.g.: {('h1', 'h4'): {'intent': intent, 'path': 's2', 'since': time_of_placement}}
 # paths: s2 - 4; s3 - 5; s4 - 6
+route_candidates = {}
+# set of candidate paths each route was placed on, indexed by (source, destination) as the routing table
+routing_print_limit = 100  # the routing table is printed after a change only up to this number of routes
+
+# placement solver (see solve_placement() and launch()): 'greedy' keeps the placement of intent_routing(), 'mcf' rebalances it
+# as a min-cost flow within solver_time_budget [s]; a flow moved off its path costs flow_move_cost, a flow above max_path_flows
+# (0: no capacity) costs more than any balancing gain
+solver_mode = 'greedy'
+solver_time_budget = 0.05
+flow_move_cost = 1.0
+max_path_flows = 0
+
+# stability policy of the rerouting (see hold_route() and launch()); 0 disables a limit
+reroute_margin = 0.0  # [ms] below the delay bound of the intent which the current path has to keep
+reroute_dwell = 0.0  # [s] minimum time on a path
+reroute_gain = 0.0  # [ms] minimum delay improvement of a move
+reroute_limit = 0  # maximum number of moves per routing cycle
 
 intents = []
-other_intents = []
+other_intents = OrderedDict()
+# unspecified flows (packets of host pairs without an intent) indexed by (source, destination), the least recently seen first;
+# the s1 entry of such a flow expires after flow_idle_timeout [s] of inactivity and the FlowRemoved event forgets the flow
+max_other_intents = 1000
+flow_idle_timeout = 10
+
+# multipath mode (see new_subflow() and launch()): the s1 entry of an intent sends its packets to the controller, which places
+# each sub-flow (IP protocol and transport ports) on one of the candidate paths of the intent, weighted by their spare capacity
+# out of link_capacity [bit/s]; a sub-flow has its own entries in s1, s5 and the interior switches at subflow_priority, and
+# expires after flow_idle_timeout [s] of inactivity like an unspecified flow
+multipath_mode = False
+link_capacity = 10e6
+subflow_priority = 110
+subflows = {}  # (source, destination) -> {(nw_proto, tp_src, tp_dst): path of the sub-flow}
 
 # testing intents
 intents.append({'source': 'h1',
@@ -89,209 +540,1167 @@ intents.append({'source': 'h2',
                 'destination': 'h6',
                 'delay': 150.0})
 
-def modify_flow(src, dst, output_switch):
-    src_ip_addr = None
-    if src == 'h1':
-        src_ip_addr = "10.0.0.1"
-    elif src == 'h2':
-        src_ip_addr = "10.0.0.2"
-    elif src == 'h3':
-        src_ip_addr = "10.0.0.3"
-
-    dst_ip_addr = None
-    if dst == 'h4':
-        dst_ip_addr = "10.0.0.4"
-    elif dst == 'h5':
-        dst_ip_addr = "10.0.0.5"
-    elif dst == 'h6':
-        dst_ip_addr = "10.0.0.6"
-
-    output_port1 = None
-    output_port2 = None
-    if output_switch == 's2':
-        output_port1 = 4
-        output_port2 = 1
-    elif output_switch == 's3':
-        output_port1 = 5
-        output_port2 = 2
-    elif output_switch == 's4':
-        output_port1 = 6
-        output_port2 = 3
-
-    msg = of.ofp_flow_mod()
-    msg.command = of.OFPFC_MODIFY_STRICT
-    msg.priority = 100
-    msg.idle_timeout = 0
-    msg.hard_timeout = 0
-    msg.match.dl_type = 0x0800
-    msg.match.nw_src = IPAddr(src_ip_addr)
-    msg.match.nw_dst = IPAddr(dst_ip_addr)
-    msg.actions.append(of.ofp_action_output(port = output_port1))
-    core.openflow.getConnection(s1_dpid).send(msg)
-
-    msg = of.ofp_flow_mod()
-    msg.command = of.OFPFC_MODIFY_STRICT
-    msg.priority = 100
-    msg.idle_timeout = 0
-    msg.hard_timeout = 0
-    msg.match.dl_type = 0x0800
-    msg.match.nw_src = IPAddr(dst_ip_addr)
-    msg.match.nw_dst = IPAddr(src_ip_addr)
-    msg.actions.append(of.ofp_action_output(port=output_port2))
-    core.openflow.getConnection(s5_dpid).send(msg)
-
-
-def delete_flow(route):
-    src = route['intent']['source']
-    src_ip_addr = None
-    if src == 'h1':
-        src_ip_addr = "10.0.0.1"
-    elif src == 'h2':
-        src_ip_addr = "10.0.0.2"
-    elif src == 'h3':
-        src_ip_addr = "10.0.0.3"
-
-    dst = route['intent']['destination']
-    dst_ip_addr = None
-    if dst == 'h4':
-        dst_ip_addr = "10.0.0.4"
-    elif dst == 'h5':
-        dst_ip_addr = "10.0.0.5"
-    elif dst == 'h6':
-        dst_ip_addr = "10.0.0.6"
-
-    output_switch = route['path']
-    output_port1 = None
-    output_port2 = None
-    if output_switch == 's2':
-        output_port1 = 4
-        output_port2 = 1
-    elif output_switch == 's3':
-        output_port1 = 5
-        output_port2 = 2
-    elif output_switch == 's4':
-        output_port1 = 6
-        output_port2 = 3
-
-    msg = of.ofp_flow_mod()
-    msg.command = of.OFPFC_DELETE_STRICT
-    msg.priority = 100
-    msg.idle_timeout = 0
-    msg.hard_timeout = 0
-    msg.match.dl_type = 0x0800
-    msg.match.nw_src = IPAddr(src_ip_addr)
-    msg.match.nw_dst = IPAddr(dst_ip_addr)
-    msg.actions.append(of.ofp_action_output(port=output_port1))
-    core.openflow.getConnection(s1_dpid).send(msg)
-
-    msg = of.ofp_flow_mod()
-    msg.command = of.OFPFC_DELETE_STRICT
-    msg.priority = 100
-    msg.idle_timeout = 0
-    msg.hard_timeout = 0
-    msg.match.dl_type = 0x0800
-    msg.match.nw_src = IPAddr(dst_ip_addr)
-    msg.match.nw_dst = IPAddr(src_ip_addr)
-    msg.actions.append(of.ofp_action_output(port=output_port2))
-    core.openflow.getConnection(s5_dpid).send(msg)
+def flow_entry(msg):
+    # shadow table key and value of a packed flow mod (the fields at the offsets of ofp_flow_mod and ofp_match of OpenFlow 1.0);
+    # the wildcarded fields are None, as in match_entry()
+    wildcards, in_port = struct.unpack_from('!LH', msg, 8)
+    dl_type, = struct.unpack_from('!H', msg, 30)
+    nw_proto = ord(msg[33])
+    nw_src, nw_dst, tp_src, tp_dst = struct.unpack_from('!LLHH', msg, 36)
+    idle_timeout, hard_timeout, priority = struct.unpack_from('!HHH', msg, 58)
+    ports = []
+    offset = 72
+    while offset + 8 <= len(msg):
+        action_type, length, port = struct.unpack_from('!HHH', msg, offset)
+        if action_type == 0:  # OFPAT_OUTPUT
+            ports.append(port)
+        offset += max(length, 8)
+    key = (None if wildcards & of.OFPFW_IN_PORT else in_port,
+           None if wildcards & of.OFPFW_DL_TYPE else dl_type,
+           None if (wildcards & of.OFPFW_NW_SRC_MASK) >> of.OFPFW_NW_SRC_SHIFT >= 32 else nw_src,
+           None if (wildcards & of.OFPFW_NW_DST_MASK) >> of.OFPFW_NW_DST_SHIFT >= 32 else nw_dst,
+           None if wildcards & of.OFPFW_NW_PROTO else nw_proto,
+           None if wildcards & of.OFPFW_TP_SRC else tp_src,
+           None if wildcards & of.OFPFW_TP_DST else tp_dst,
+           priority)
+    return key, (idle_timeout, hard_timeout, tuple(ports))
+
+
+def match_entry(match, priority):
+    # shadow table key of an entry reported by the switch (flow stats, FLOW_REMOVED)
+    return (match.in_port, match.dl_type,
+            None if match.nw_src is None else IPAddr(match.nw_src).toUnsigned(),
+            None if match.nw_dst is None else IPAddr(match.nw_dst).toUnsigned(),
+            match.nw_proto, match.tp_src, match.tp_dst, priority)
+
+
+def send_flow_mod(dpid, msg, transaction=None):
+    # the flow mod is collected by the transaction if there is one, otherwise it is sent right away;
+    # an add or modify of an entry which the shadow table of the switch holds with the same actions is not sent
+    global redundant_flow_mods
+    table = flow_tables.get(dpid)
+    if table is not None and isinstance(msg, bytes):
+        command, = struct.unpack_from('!H', msg, 56)
+        key, value = flow_entry(msg)
+        if command == of.OFPFC_DELETE_STRICT:
+            table.pop(key, None)
+        elif command == of.OFPFC_DELETE:
+            table.clear()  # not tracked by match, the entries are sent again when needed
+        elif table.get(key) == value:
+            redundant_flow_mods += 1
+            return
+        else:
+            table[key] = value
+    if transaction is not None:
+        transaction.add(dpid, msg)
+    else:
+        send_messages(dpid, [msg], PRIORITY_BULK)
+
+
+def message_bucket(dpid):
+    bucket = message_buckets.get(dpid)
+    if bucket is None:
+        bucket = TokenBucket(message_rate_limit, message_burst_size)
+        message_buckets[dpid] = bucket
+    return bucket
+
+
+def fresh_xid(msg):
+    # a packed flow mod is cached and sent again (see route_flow_mods()), so it gets a new xid every time it is sent
+    return msg[:4] + struct.pack('!L', of.generate_xid()) + msg[8:]
+
+
+def send_messages(dpid, msgs, priority):
+    # sends the packed messages to the switch in one send() when its token bucket allows it and no message of the same
+    # or a higher priority waits, otherwise they are queued (a barrier request is queued but takes no token)
+    msgs = [fresh_xid(msg) if ord(msg[1]) == of.OFPT_FLOW_MOD else msg for msg in msgs]
+    connection = core.openflow.getConnection(dpid)
+    if message_rate_limit <= 0:
+        connection.send(''.join(msgs))
+        return
+    bucket = message_bucket(dpid)
+    bucket.refill()
+    keys = [flow_entry(msg)[0] if ord(msg[1]) == of.OFPT_FLOW_MOD else None for msg in msgs]
+    deletes = [key is not None and struct.unpack_from('!H', msg, 56)[0] in (of.OFPFC_DELETE, of.OFPFC_DELETE_STRICT)
+               for msg, key in zip(msgs, keys)]
+    count = len([msg for msg in msgs if ord(msg[1]) != of.OFPT_BARRIER_REQUEST])
+    top = bucket.top()
+    # a flow mod of an entry with a queued delete waits behind the delete
+    behind = len([key for key in keys if key is not None and key in bucket.deletes]) > 0
+    if priority == PRIORITY_PROBE or ((top is None or top[0] > priority) and not behind and bucket.take(count)):
+        if priority == PRIORITY_PROBE:
+            bucket.tokens -= count
+        for key, delete in zip(keys, deletes):
+            if key is not None:
+                bucket.supersede(key, delete)
+        connection.send(''.join(msgs))
+        return
+    for msg, key, delete in zip(msgs, keys, deletes):
+        bucket.push(priority, msg, key, delete)
+
+
+def drain_message_queues():
+    # sends the queued messages as the token buckets refill
+    for dpid, bucket in message_buckets.iteritems():
+        bucket.refill()
+        msgs = []
+        while bucket.top() is not None and bucket.take(0 if ord(bucket.top()[2][1]) == of.OFPT_BARRIER_REQUEST else 1):
+            msgs.append(bucket.pop())
+        connection = core.openflow.getConnection(dpid)
+        if msgs and connection is not None:
+            connection.send(''.join(msgs))
+
+
+def admit_packet_in(key):
+    # a packet-in of a pair whose flow entries are being installed (their transaction is not confirmed yet) is a duplicate
+    # miss of the same flow, so it is dropped
+    global coalesced_packet_ins
+    transaction = flow_installs.get(key)
+    if transaction is None:
+        return True
+    if transaction.commit_time is not None and transaction.complete_time is None and \
+            time.time() - transaction.commit_time < transaction_timeout:
+        coalesced_packet_ins += 1
+        return False
+    del flow_installs[key]
+    return True
+
+
+def expire_transactions():
+    # forget the transactions whose barrier replies have not arrived within transaction_timeout (e.g. the switch disconnected)
+    now = time.time()
+    for key, transaction in pending_barriers.items():
+        if now - transaction.commit_time > transaction_timeout:
+            del pending_barriers[key]
+            if transaction.complete_time is None:
+                transaction.complete_time = now
+                log.warning("Transaction %s has not been confirmed by all switches", transaction.name)
+
+
+def compile_tables():
+    # builds the lookup tables from the host table and drops the cached messages built from the previous tables
+    global transit_rules
+    host_ips.clear()
+    ip_hosts.clear()
+    raw_ip_hosts.clear()
+    edge_hosts.clear()
+    for host in sorted(hosts):
+        ip_addr, switch, port = hosts[host]
+        host_ips[host] = IPAddr(ip_addr)
+        ip_hosts[IPAddr(ip_addr)] = host
+        raw_ip_hosts[IPAddr(ip_addr).toRaw()] = host
+        edge_hosts.setdefault(switch, []).append(host)
+    flow_mod_cache.clear()
+    host_rule_cache.clear()
+    output_actions.clear()
+    probe_frames.clear()
+
+    # forwarding of ARP (x0806) and IP (x0800) packets between port 1 (s1 side) and port 2 (s5 side) of s2, s3 and s4
+    # (diamond topology only, the interior switches of the other topologies get a rule per route)
+    transit_rules = []
+    for in_port, out_port in ((1, 2), (2, 1)):
+        for dl_type in (0x0806, 0x0800):
+            msg = of.ofp_flow_mod()
+            msg.priority = 10
+            msg.idle_timeout = 0
+            msg.hard_timeout = 0
+            msg.match.in_port = in_port
+            msg.match.dl_type = dl_type
+            msg.actions.append(of.ofp_action_output(port=out_port))
+            transit_rules.append(msg.pack())
+
+
+def route_flow_mods(src, dst, path, command, idle_timeout=0):
+    # packed flow mods of a route: s1 (src -> dst towards the path) and s5 (dst -> src towards the path), and outside
+    # the diamond also both directions in each interior switch of the path; returned as (switch, message) pairs;
+    # they are packed once and reused every time the route is installed or deleted (with a new xid, see fresh_xid());
+    # with idle_timeout the s1 entry expires when the flow goes idle and the switch reports it in a FLOW_REMOVED message;
+    # in the multipath mode the s1 entry of an intent sends its packets to the controller (see new_subflow())
+    split = multipath_mode and (src, dst) not in other_intents
+    key = (src, dst, path, command, idle_timeout, split)
+    msgs = flow_mod_cache.get(key)
+    if msgs is None:
+        entries = [(ingress_switch, host_ips[src], host_ips[dst], of.OFPP_CONTROLLER if split else path_ports[path][0], idle_timeout),
+                   (egress_switch, host_ips[dst], host_ips[src], path_ports[path][1], 0)]
+        if topology_mode != 'diamond':
+            for switch, forward_port, reverse_port in path_hop_ports[path]:
+                entries.append((switch, host_ips[src], host_ips[dst], forward_port, 0))
+                entries.append((switch, host_ips[dst], host_ips[src], reverse_port, 0))
+        msgs = []
+        for switch, nw_src, nw_dst, port, idle in entries:
+            msg = of.ofp_flow_mod()
+            msg.command = command
+            msg.priority = 100
+            msg.idle_timeout = idle
+            msg.hard_timeout = 0
+            if idle > 0:
+                msg.flags = of.OFPFF_SEND_FLOW_REM
+            msg.match.dl_type = 0x0800
+            msg.match.nw_src = nw_src
+            msg.match.nw_dst = nw_dst
+            msg.actions.append(of.ofp_action_output(port=port))
+            msgs.append((switch, msg.pack()))
+        msgs = tuple(msgs)
+        flow_mod_cache[key] = msgs
+    return msgs
+
+
+def subflow_key(data):
+    # sub-flow of an IP packet: (IP protocol, source port, destination port), without ports for other protocols than TCP and UDP
+    nw_proto = ord(data[23])
+    if nw_proto in (6, 17):
+        offset = 14 + (ord(data[14]) & 0x0f) * 4  # the transport header follows the IP options
+        if len(data) >= offset + 4:
+            return (nw_proto,) + struct.unpack_from('!HH', data, offset)
+    return nw_proto, None, None
+
+
+def subflow_flow_mods(src, dst, subflow, path, command):
+    # packed flow mods of a sub-flow on the path, as route_flow_mods() without the cache: s1 (src -> dst, expiring after
+    # flow_idle_timeout), s5 (dst -> src with the ports swapped) and outside the diamond both directions in the interior switches
+    nw_proto, tp_src, tp_dst = subflow
+    entries = [(ingress_switch, host_ips[src], host_ips[dst], tp_src, tp_dst, path_ports[path][0], flow_idle_timeout),
+               (egress_switch, host_ips[dst], host_ips[src], tp_dst, tp_src, path_ports[path][1], 0)]
+    if topology_mode != 'diamond':
+        for switch, forward_port, reverse_port in path_hop_ports[path]:
+            entries.append((switch, host_ips[src], host_ips[dst], tp_src, tp_dst, forward_port, 0))
+            entries.append((switch, host_ips[dst], host_ips[src], tp_dst, tp_src, reverse_port, 0))
+    msgs = []
+    for switch, nw_src, nw_dst, sport, dport, port, idle in entries:
+        msg = of.ofp_flow_mod()
+        msg.command = command
+        msg.priority = subflow_priority
+        msg.idle_timeout = idle
+        msg.hard_timeout = 0
+        if idle > 0:
+            msg.flags = of.OFPFF_SEND_FLOW_REM
+        msg.match.dl_type = 0x0800
+        msg.match.nw_proto = nw_proto
+        msg.match.nw_src = nw_src
+        msg.match.nw_dst = nw_dst
+        msg.match.tp_src = sport
+        msg.match.tp_dst = dport
+        msg.actions.append(of.ofp_action_output(port=port))
+        msgs.append((switch, msg.pack()))
+    return msgs
+
+
+def subflow_path(src, dst, subflow, candidates):
+    # a point given by the hash of the sub-flow picks one of the candidate paths on the cumulated spare capacity of the paths,
+    # so that the sub-flows spread over the paths in proportion to their spare capacity (at least 5% of the link capacity each)
+    paths = sorted(candidates)
+    weights = [max(link_capacity - path_load[path].bps, 0.05 * link_capacity) for path in paths]
+    point = (zlib.crc32("%s %s %s %s %s" % ((src, dst) + subflow)) & 0xffffffff) / 4294967296.0 * sum(weights)
+    for path, weight in zip(paths, weights):
+        point -= weight
+        if point < 0:
+            return path
+    return paths[-1]
+
+
+def new_subflow(event, data, key, route):
+    # a packet of an intent at s1 in the multipath mode: its sub-flow is placed on one of the candidate paths of the intent
+    # and the packet is sent on along that path
+    subflow = subflow_key(data)
+    if not admit_packet_in(key + subflow):
+        return
+    candidates = [path for path in route_candidates[key] if path not in down_paths] or [route['path']]
+    path = subflow_path(key[0], key[1], subflow, candidates)
+    subflows.setdefault(key, {})[subflow] = path
+    transaction = FlowModTransaction('subflow')
+    modify_flow(key[0], key[1], route['path'], transaction)  # the entries of the intent itself, if they are missing
+    msgs = subflow_flow_mods(key[0], key[1], subflow, path, of.OFPFC_MODIFY_STRICT)
+    forget_flow_mod(event.dpid, msgs[0][1])  # the packet shows that the s1 entry of the sub-flow is missing
+    for switch, msg in msgs:
+        send_flow_mod(switch_dpid(switch), msg, transaction)
+    transaction.commit()
+    flow_installs[key + subflow] = transaction
+    send_messages(event.dpid, [packet_out(event.ofp, path_ports[path][0])], PRIORITY_BULK)
+
+
+def move_subflows(transaction):
+    # the sub-flows of the pairs which are no longer routed intents are forgotten (their entries expire), and the sub-flows
+    # on paths which are no longer candidates of their intent (or are down) are placed again
+    moved = 0
+    for key in subflows.keys():
+        route = current_routing.get(key)
+        if not multipath_mode or route is None or key in other_intents:
+            del subflows[key]
+            continue
+        candidates = [path for path in route_candidates[key] if path not in down_paths] or [route['path']]
+        for subflow, path in subflows[key].items():
+            if path in candidates:
+                continue
+            path = subflow_path(key[0], key[1], subflow, candidates)
+            subflows[key][subflow] = path
+            for switch, msg in subflow_flow_mods(key[0], key[1], subflow, path, of.OFPFC_MODIFY_STRICT):
+                send_flow_mod(switch_dpid(switch), msg, transaction)
+            moved += 1
+    return moved
+
+
+def remove_subflow(key, subflow, transaction):
+    # the s1 entry of a sub-flow has expired: the sub-flow is forgotten and its other entries are deleted
+    path = subflows.get(key, {}).pop(subflow, None)
+    flow_installs.pop(key + subflow, None)
+    if path is None:
+        return
+    if subflows[key] == {}:
+        del subflows[key]
+    for switch, msg in subflow_flow_mods(key[0], key[1], subflow, path, of.OFPFC_DELETE_STRICT)[1:]:
+        send_flow_mod(switch_dpid(switch), msg, transaction)
+
+
+def switch_dpid(switch):
+    # the switch of the topology if it has connected, 0 otherwise (no message is sent to it)
+    return switch if switch in connected_switches else 0
+
+
+def modify_flow(src, dst, output_switch, transaction=None, idle_timeout=0):
+    for switch, msg in route_flow_mods(src, dst, output_switch, of.OFPFC_MODIFY_STRICT, idle_timeout):
+        send_flow_mod(switch_dpid(switch), msg, transaction)
+
+
+def forget_flow(src, dst, output_switch, idle_timeout=0):
+    # the entries of the route are missing in a switch (a packet of the route has come to the controller instead),
+    # so they are dropped from the shadow tables and sent again by the next modify_flow()
+    for switch, msg in route_flow_mods(src, dst, output_switch, of.OFPFC_MODIFY_STRICT, idle_timeout):
+        forget_flow_mod(switch_dpid(switch), msg)
+
+
+def forget_flow_mod(dpid, msg):
+    table = flow_tables.get(dpid)
+    if table is not None:
+        table.pop(flow_entry(msg)[0], None)
+
+
+def delete_flow(route, transaction=None):
+    for switch, msg in route_flow_mods(route['intent']['source'], route['intent']['destination'], route['path'], of.OFPFC_DELETE_STRICT):
+        send_flow_mod(switch_dpid(switch), msg, transaction)
+
+
+def remove_unspecified_flow(key, transaction=None):
+    # forgets an unspecified flow: its path is released and its route is deleted from the switches
+    flow = other_intents.pop(key, None)
+    route = current_routing.get(key)
+    if flow is not None and route is not None and route['intent'] is flow:
+        del current_routing[key]
+        del route_candidates[key]
+        current_flows[route['path']] -= 1
+        delete_flow(route, transaction)
+
+
+def host_rule(host, dl_type=0x0800):
+    # packed rule for IP packets (x0800), or ARP packets (x0806, matched on the target address), to a host attached to the switch
+    msg = host_rule_cache.get((host, dl_type))
+    if msg is None:
+        ip_addr, switch, port = hosts[host]
+        msg = of.ofp_flow_mod()
+        msg.priority = 100
+        msg.idle_timeout = 0
+        msg.hard_timeout = 0
+        msg.match.dl_type = dl_type
+        msg.match.nw_dst = host_ips[host]
+        msg.actions.append(of.ofp_action_output(port=port))
+        msg = msg.pack()
+        host_rule_cache[(host, dl_type)] = msg
+    return msg
+
+
+def static_rules(dpid):
+    # rules which do not depend on the measured delays: the local hosts of s1 and s5, and the transit rules of s2, s3 and s4
+    if dpid == s1_dpid or dpid == s5_dpid:
+        return [host_rule(host) for host in edge_hosts.get(dpid, [])]
+    elif topology_mode == 'diamond' and dpid in adjacency:
+        return transit_rules
+    return []
+
+
+def install_static_rules(dpid, transaction=None, missing=False):
+    # with missing, a packet which the rules should have forwarded has come to the controller, so they are sent
+    # even if the shadow table of the switch holds them
+    for msg in static_rules(dpid):
+        if missing:
+            forget_flow_mod(dpid, msg)
+        send_flow_mod(dpid, msg, transaction)
+
+
+def install_arp_rules(dpid, transaction=None):
+    # ARP rules of the 'proactive' ARP mode: the ARP packets to the local hosts of s1 and s5 are forwarded by the switch
+    if dpid == s1_dpid or dpid == s5_dpid:
+        for host in edge_hosts.get(dpid, []):
+            send_flow_mod(dpid, host_rule(host, 0x0806), transaction)
+
+
+def packet_out(packet_in, port):
+    # packed PACKET_OUT sending the packet of a PACKET_IN to the port; the output action is packed once per port
+    action = output_actions.get(port)
+    if action is None:
+        action = of.ofp_action_output(port=port).pack()
+        output_actions[port] = action
+    if packet_in.buffer_id is None:
+        buffer_id = of.NO_BUFFER
+        data = packet_in.data  # the packet has not been buffered by the switch, so it is sent back whole
+    else:
+        buffer_id = packet_in.buffer_id
+        data = ''
+    return struct.pack('!BBHLLHH', of.OFP_VERSION, of.OFPT_PACKET_OUT, 16 + len(action) + len(data), of.generate_xid(),
+                       buffer_id, packet_in.in_port, len(action)) + action + data
+
+
+def arp_reply(packet_in, request, mac):
+    # packed PACKET_OUT answering the ARP request of a PACKET_IN through its input port on behalf of the host with the MAC address
+    action = output_actions.get(of.OFPP_IN_PORT)
+    if action is None:
+        action = of.ofp_action_output(port=of.OFPP_IN_PORT).pack()
+        output_actions[of.OFPP_IN_PORT] = action
+    reply = arp()
+    reply.opcode = arp.REPLY
+    reply.hwsrc = mac
+    reply.hwdst = request.hwsrc
+    reply.protosrc = request.protodst
+    reply.protodst = request.protosrc
+    e = ethernet()
+    e.type = ethernet.ARP_TYPE
+    e.src = mac
+    e.dst = request.hwsrc
+    e.payload = reply
+    data = e.pack()
+    return struct.pack('!BBHLLHH', of.OFP_VERSION, of.OFPT_PACKET_OUT, 16 + len(action) + len(data), of.generate_xid(),
+                       of.NO_BUFFER, packet_in.in_port, len(action)) + action + data
+
+
+def edge_arp(event, a, switch, default_port):
+    # ARP packet at an edge switch: the binding of a local host is learned from its own packets (Mininet sets the MAC
+    # addresses with autoSetMacs); a request for a host with a known binding is answered by the controller in the proxy
+    # modes, other ARP packets are forwarded to the local host or towards the other edge over the lowest delay path
+    host = ip_hosts.get(a.protosrc)
+    if host is not None and hosts[host][1] == switch and hosts[host][2] == event.port:
+        arp_table[a.protosrc] = a.hwsrc
+    if a.protodst not in ip_hosts:
+        return
+    if arp_mode != 'forward' and a.opcode == arp.REQUEST and a.protodst in arp_table:
+        send_messages(event.dpid, [arp_reply(event.ofp, a, arp_table[a.protodst])], PRIORITY_BULK)
+        return
+    host = ip_hosts[a.protodst]
+    if hosts[host][1] == switch:
+        send_messages(event.dpid, [packet_out(event.ofp, hosts[host][2])], PRIORITY_BULK)
+    else:
+        send_messages(event.dpid, [packet_out(event.ofp, default_port)], PRIORITY_BULK)
+
+
+def switch_name(dpid):
+    # name of a switch in the printouts and in the names of the paths: sN for the DPID N, as Mininet numbers its switches
+    return 's%d' % dpid
+
+
+def shortest_path(source, target, weight, removed_links, removed_switches):
+    # Dijkstra over the topology without the removed links and switches; returns (cost, switches) or None;
+    # a link is used when both of its directions are known (the routes are installed in both directions)
+    queue = [(0.0, [source])]
+    done = set()
+    while queue:
+        cost, hops = heapq.heappop(queue)
+        switch = hops[-1]
+        if switch == target:
+            return cost, hops
+        if switch in done:
+            continue
+        done.add(switch)
+        for neighbour in adjacency.get(switch, {}):
+            if neighbour not in done and neighbour not in removed_switches and (switch, neighbour) not in removed_links and \
+                    switch in adjacency.get(neighbour, {}):
+                heapq.heappush(queue, (cost + weight(switch, neighbour), hops + [neighbour]))
+    return None
+
+
+def k_shortest_paths(source, target, k, weight):
+    # Yen's algorithm: the next shortest path deviates from one of the paths found so far at a spur switch, with the root
+    # (the part up to the spur switch) kept and the links already taken from that root removed; equal costs are ordered
+    # by the DPIDs of the switches
+    first = shortest_path(source, target, weight, set(), set())
+    if first is None:
+        return []
+    paths = [first]
+    candidates = []
+    while len(paths) < k:
+        last = paths[-1][1]
+        for i in range(len(last) - 1):
+            root = last[:i + 1]
+            removed_links = set([(hops[i], hops[i + 1]) for cost, hops in paths if hops[:i + 1] == root])
+            spur = shortest_path(last[i], target, weight, removed_links, set(root[:-1]))
+            if spur is not None:
+                root_cost = sum([weight(a, b) for a, b in zip(root, root[1:])])
+                candidate = (root_cost + spur[0], root[:-1] + spur[1])
+                if candidate not in candidates and candidate[1] not in [hops for cost, hops in paths]:
+                    heapq.heappush(candidates, candidate)
+        if candidates == []:
+            break
+        paths.append(heapq.heappop(candidates))
+    return [hops for cost, hops in paths]
+
+
+def update_paths(margin=0.0):
+    # the k shortest paths between the edge switches, weighted by the measured delays of the links (the links of s1,
+    # or every link with path_delay_mode 'oneway' or 'rtt'), default_link_delay for the other links; a path needs an
+    # interior switch, where its probes come back. With margin [ms] the current paths are kept unless the new ones are
+    # shorter by margin in total (a change of the links replaces them anyway: some current path is gone or there are more
+    # paths now), so that the routes are not moved back and forth by every change of the delays.
+    def weight(a, b):
+        if (a, b) in segment_delay:
+            return max(segment_delay[(a, b)], 0)  # the link has been probed, possibly while it was on another path
+        return default_link_delay
+
+    paths = [hops for hops in k_shortest_paths(ingress_switch, egress_switch, max_paths, weight) if len(hops) > 2]
+    current = [path_hops.get(path) for path in measured_paths]
+    if sorted(paths) == sorted(current):
+        return
+    if margin > 0 and len(paths) == len(current) and \
+            [hops for hops in current if [a for a, b in zip(hops, hops[1:]) if b not in adjacency.get(a, {})]] == []:
+        def length(hops):
+            return sum([weight(a, b) for a, b in zip(hops, hops[1:])])
+        if sum([length(hops) for hops in current]) - sum([length(hops) for hops in paths]) < margin:
+            return
+    set_paths(paths)
+
+    # a new path starts from the delay of its links if they have been measured already
+    for path in measured_paths:
+        forward, reverse = path_segments(path)
+        if link_delay[path].count > 0:
+            continue
+        if path_delay_mode == 'first_hop' and forward[0] in segment_delay:
+            link_delay[path].add(segment_delay[forward[0]])
+        elif path_delay_mode != 'first_hop' and [link for link in forward + reverse if link not in segment_delay] == []:
+            oneway = sum([segment_delay[link] for link in forward])
+            path_delays[path] = (oneway, oneway + sum([segment_delay[link] for link in reverse]))
+            link_delay[path].add(path_delays[path][0 if path_delay_mode == 'oneway' else 1])
+
+
+def set_paths(paths):
+    # replaces the measured paths; the routes of the paths which disappeared are deleted (the intents are placed again
+    # in the next routing cycle, the unspecified flows with their next packet) and the state of the new paths is created
+    global current_delays, probe_frames
+    names = ['-'.join([switch_name(switch) for switch in hops[1:-1]]) for hops in paths]
+    transaction = FlowModTransaction('topology', PRIORITY_REROUTE)
+    for key, route in current_routing.items():
+        if route['path'] not in names:
+            if key in other_intents:
+                remove_unspecified_flow(key, transaction)
+            else:
+                delete_flow(route, transaction)
+                current_flows[route['path']] -= 1
+                del current_routing[key]
+                del route_candidates[key]
+        elif not route_candidates[key] <= frozenset(names):
+            route_candidates[key] = route_candidates[key] & frozenset(names)  # the surviving routes lose the dropped paths
+    # the sub-flows on the dropped paths are deleted while the ports of their paths are known; their next packet places them again
+    for key in subflows.keys():
+        for subflow, path in subflows[key].items():
+            if path not in names:
+                del subflows[key][subflow]
+                for switch, msg in subflow_flow_mods(key[0], key[1], subflow, path, of.OFPFC_DELETE_STRICT):
+                    send_flow_mod(switch_dpid(switch), msg, transaction)
+        if subflows[key] == {}:
+            del subflows[key]
+    transaction.commit()
+
+    for path in measured_paths:
+        if path not in names:
+            for table in (link_sent_time2, link_OWD2, link_delay, path_load, current_flows, path_hops, path_hop_ports, path_ports, path_probe_period, last_probe_time, next_probe_time, pending_segments, path_delays):
+                table.pop(path, None)
+            probe_paths.pop(probe_ids.pop(path, None), None)
+    for name, hops in zip(names, paths):
+        if name not in link_delay:
+            link_sent_time2[name] = 0.0
+            link_OWD2[name] = 0.0
+            link_delay[name] = DelayHistory(history_size, history_alpha, forecast_alpha, forecast_beta)
+            path_load[name] = CounterRate()
+            current_flows[name] = 0
+        if name not in probe_ids:
+            probe_ids[name] = max(probe_paths.keys() + [0]) + 1
+            probe_paths[probe_ids[name]] = name
+        path_hops[name] = hops
+        path_hop_ports[name] = [(hops[i], adjacency[hops[i]][hops[i + 1]], adjacency[hops[i]][hops[i - 1]])
+                                for i in range(1, len(hops) - 1)]
+        path_ports[name] = (adjacency[ingress_switch][hops[1]], adjacency[egress_switch][hops[-2]])
+    measured_paths[:] = names
+    update_down_paths()
+    current_delays = []
+    backup_paths.clear()
+    flow_mod_cache.clear()
+    probe_frames.clear()
+    print "Paths:", ", ".join([name + " (" + "-".join([switch_name(switch) for switch in path_hops[name]]) + ")" for name in measured_paths])
+
+
+def interior_arp_port(dpid, in_port):
+    # output port of an ARP packet in an interior switch (outside the diamond): the packet continues along a path
+    # through the switch which it has come from, the lowest delay path first
+    for delay in reversed(current_delays or [{'path': path} for path in measured_paths]):
+        for hop, forward_port, reverse_port in path_hop_ports.get(delay['path'], []):
+            if hop == dpid and in_port == reverse_port:
+                return forward_port
+            elif hop == dpid and in_port == forward_port:
+                return reverse_port
+    return None
+
+
+def _handle_LinkEvent(event):
+    # link discovered or lost by openflow.discovery (each direction of a link is reported separately)
+    link = event.link
+    a, b = link.dpid1, link.dpid2
+    if event.added:
+        adjacency.setdefault(a, {})[b] = link.port1
+        link_up([(a, link.port1)])
+    elif event.removed and b in adjacency.get(a, {}):
+        # the routes leave the paths of the lost link before the paths are computed again
+        link_down([(a, link.port1)])
+        del adjacency[a][b]
+    update_paths()
+
+
+def path_uses(path, switch, port=None):
+    # whether the path goes out of the port of the switch (through the switch at all when port is None)
+    if switch == ingress_switch:
+        return port is None or path_ports[path][0] == port
+    elif switch == egress_switch:
+        return port is None or path_ports[path][1] == port
+    for hop, forward_port, reverse_port in path_hop_ports.get(path, []):
+        if hop == switch and (port is None or port == forward_port or port == reverse_port):
+            return True
+    return False
+
+
+def usable_paths():
+    return [path for path in measured_paths if path not in down_paths]
+
+
+def update_down_paths():
+    # the paths through the ports in down_ports; returns the paths which went down and the paths which came back
+    global down_paths
+    paths = set([path for path in measured_paths if [port for port in down_ports if path_uses(path, *port)] != []])
+    went_down = paths - down_paths
+    came_back = down_paths - paths
+    down_paths = paths
+    return went_down, came_back
+
+
+def link_down(ports):
+    # (switch, port) pairs which went down: the routes of the broken paths are moved right away
+    down_ports.update(ports)
+    went_down, came_back = update_down_paths()
+    if went_down:
+        fail_over(went_down)
+
+
+def link_up(ports):
+    # (switch, port) pairs which came back: their paths are measured again and return to the routing in its next cycle;
+    # the routes left on down paths (no path was usable when they went down) are moved to the paths which came back
+    down_ports.difference_update(ports)
+    went_down, came_back = update_down_paths()
+    if came_back:
+        print "Paths up again:", ", ".join(sorted(came_back))
+        stranded = set([route['path'] for route in current_routing.itervalues() if route['path'] in down_paths])
+        if stranded:
+            fail_over(stranded)
+
+
+def fail_over(paths):
+    # Fast reroute: the routes of the paths which went down are moved in one transaction, without waiting for the routing
+    # cycle; a route goes to its backup path (see compute_backup_paths()) if that is still one of its candidates,
+    # otherwise to the least loaded of its candidates among the usable paths (ordered by the last known delays).
+    global current_delays, default_route_s1, default_route_s5
+    started = default_timer()
+    usable = usable_paths()
+    current_delays = [delay for delay in current_delays if delay['path'] not in down_paths]
+    if usable == []:
+        print "Failover: paths", ", ".join(sorted(paths)), "down and no usable path left"
+        return
+    path_delay = dict([(path, get_link_delay(path)) for path in usable])
+    ascending = sorted(usable, key=lambda path: path_delay[path])
+    ascending_delays = [path_delay[path] for path in ascending]
+    loads = path_loads()
+    now = time.time()
+    transaction = FlowModTransaction('failover', PRIORITY_REROUTE)
+    moved = 0
+    for key, route in current_routing.items():
+        if route['path'] not in paths:
+            continue
+        if key in other_intents:
+            candidates = frozenset(usable)
+        else:
+            candidates = frozenset(ascending[:max(1, bisect_left(ascending_delays, route['intent']['delay']))])
+        path = backup_paths.pop(key, None)
+        if path not in candidates:
+            path = least_loaded_path([candidate for candidate in reversed(ascending) if candidate in candidates],
+                                     current_flows, loads)
+        current_flows[route['path']] -= 1
+        current_flows[path] += 1
+        if loads is not None:
+            loads[path] += flow_rate(key)
+        current_routing[key] = {'intent': route['intent'], 'path': path, 'since': now}
+        route_candidates[key] = candidates
+        if key in other_intents:
+            modify_flow(key[0], key[1], path, transaction, flow_idle_timeout)
+        else:
+            modify_flow(key[0], key[1], path, transaction)
+        moved += 1
+    moved += move_subflows(transaction)
+    transaction.commit()
+
+    # ARP packets between the edges follow the lowest delay usable path
+    default_route_s1, default_route_s5 = path_ports[ascending[0]]
+    print "Failover: paths", ", ".join(sorted(paths)), "down;", moved, "routes moved in", \
+        round((default_timer() - started) * 1000, 2), "[ms]"
+    print "Current flows:", print_paths(current_flows)
+
+
+def compute_backup_paths(transaction):
+    # Backup path of each route for fail_over(): one of its other candidate paths, preferably one which shares no interior
+    # switch with its path (none when the path is its only candidate); the backups are spread over these paths as the flows
+    # are, the flows already backed up by a path counting as its flows. Outside the diamond the interior switches of a new
+    # backup path get the entries of the route in advance, so that a failover only rewrites the edge switches.
+    choices = {}  # (candidates, path) -> paths which may back up the path, in the order of decreasing delay
+    flows = dict(current_flows)
+    for key, route in current_routing.iteritems():
+        choice = (route_candidates[key], route['path'])
+        if choice not in choices:
+            others = [delay['path'] for delay in current_delays if delay['path'] in choice[0] and delay['path'] != choice[1]]
+            disjoint = [path for path in others if not [hop for hop in path_hops.get(path, [])[1:-1]
+                                                        if hop in path_hops.get(choice[1], [])]]
+            choices[choice] = disjoint or others
+        if choices[choice] == []:
+            backup_paths.pop(key, None)
+            continue
+        path = least_loaded_path(choices[choice], flows)
+        flows[path] += 1
+        if backup_paths.get(key) != path:
+            backup_paths[key] = path
+            idle_timeout = flow_idle_timeout if key in other_intents else 0
+            for switch, msg in route_flow_mods(key[0], key[1], path, of.OFPFC_MODIFY_STRICT, idle_timeout)[2:]:
+                send_flow_mod(switch_dpid(switch), msg, transaction)
+    for key in backup_paths.keys():
+        if key not in current_routing:
+            del backup_paths[key]
+
+
+def _handle_PortStatus(event):
+    # a port which is deleted, administratively down or without link breaks the paths going out of it
+    desc = event.ofp.desc
+    if event.deleted or desc.state & of.OFPPS_LINK_DOWN or desc.config & of.OFPPC_PORT_DOWN:
+        link_down([(event.dpid, event.port)])
+    else:
+        link_up([(event.dpid, event.port)])
+
+
+def _handle_ConnectionDown(event):
+    # a disconnected switch breaks all the paths through it; its shadow table is rebuilt when it connects again
+    flow_tables.pop(event.dpid, None)
+    reconcile_xids.pop(event.dpid, None)
+    link_down([(event.dpid, None)])
+
+
+def get_link_delay(path):
+    # delay of the S1-SX link of the path [ms] according to the configured estimator, in the forecast mode at least
+    # the upper bound of its forecast for the next routing cycle while the delay is rising (a falling delay is left
+    # to the estimator, the path is not held back by the errors of the forecast)
+    delay = link_delay[path].estimate(delay_estimator, delay_percentile)
+    if forecast_mode and link_delay[path].trend > 0:
+        if probe_mode == 'round_robin':
+            horizon = (len(measured_paths) + 1) * probe_interval  # the routing follows the probes of all the paths
+        else:
+            horizon = routing_ticks * probe_interval
+        return max(delay, link_delay[path].forecast(horizon, forecast_z))
+    return delay
+
+
+def least_loaded_path(paths, flows, loads=None):
+    # paths are ordered by decreasing delay, so among equally loaded paths the one with the lowest delay is chosen;
+    # with loads (the projected load of the paths [bit/s]) the numbers of flows only break the ties between equal loads
+    best_path_load = None
+    optimal_path = None
+    for x, path in enumerate(paths):
+        if loads is None:
+            load = flows[path]
+        else:
+            load = (loads[path], flows[path])
+        if x == 0 or load <= best_path_load:
+            best_path_load = load
+            optimal_path = path
+    return optimal_path
+
+
+def path_loads():
+    # measured load of the paths [bit/s] for the 'load' placement, None for the 'flows' placement
+    if placement_mode != 'load':
+        return None
+    return dict([(path, path_load[path].bps) for path in measured_paths])
+
+
+def flow_rate(key):
+    # estimated rate of a flow [bit/s]: its rate measured from the flow stats, otherwise the average rate of the flows
+    # sharing its path, or of all the routed flows when the flow is not routed yet;
+    # it is at least min_flow_rate, so that new flows are not all placed on one idle path
+    meter = forward_rates.get(key)
+    if meter is not None and meter.bps > 0:
+        return max(meter.bps, min_flow_rate)
+    route = current_routing.get(key)
+    if route is not None and current_flows[route['path']] > 0:
+        return max(path_load[route['path']].bps / current_flows[route['path']], min_flow_rate)
+    total_flows = sum(current_flows.values())
+    if total_flows > 0:
+        return max(sum([path_load[path].bps for path in measured_paths]) / total_flows, min_flow_rate)
+    return min_flow_rate
+
+
+def print_paths(values):
+    # 'S2: 1; S3: 0; S4: 2' for the measured paths
+    return "; ".join([path.upper() + ": " + str(values[path]) for path in measured_paths])
+
+
+def hold_route(intent, route, candidates, new_path, path_delay, now, reroutes):
+    # Stability policy: a route which still meets the delay bound of its intent with reroute_margin [ms] to spare is not moved
+    # before it has stayed reroute_dwell [s] on its path, for less than reroute_gain [ms] of delay improvement,
+    # or when reroute_limit routes have already been moved in this cycle (0 disables each of the limits).
+    if route['path'] not in candidates or route['path'] not in path_delay:
+        return False  # the path is no longer a candidate, or it is down
+    current_delay = path_delay[route['path']]
+    if current_delay >= intent['delay'] - reroute_margin:
+        return False  # the delay bound is broken or about to be, so the intent has to move
+    if reroute_dwell > 0 and now - route['since'] < reroute_dwell:
+        return True
+    if reroute_gain > 0 and current_delay - path_delay[new_path] < reroute_gain:
+        return True
+    if reroute_limit > 0 and reroutes >= reroute_limit:
+        return True
+    return False
+
+
+def solve_placement(now):
+    # Min-cost flow over the routed flows (intents and unspecified flows), starting from the greedy placement:
+    # the cost of a path with L flows is L^2 (plus the capacity penalty), so the marginal cost of a flow is convex.
+    # The greedy placement is improved by moving flows along the cheapest chain of paths p0 -> p1 -> ... -> pk
+    # (a flow of p0 goes to p1, a flow of p1 to p2, ...; every flow stays on its candidate paths): only p0 loses
+    # and pk gains a flow, so the change of cost is known from the loads of p0 and pk and the move costs of the chain
+    # (several flows are moved along a chain at once while each of them lowers the cost).
+    # The cheapest chains between all paths are found with Floyd-Warshall over the paths; the placement is optimal when
+    # no chain lowers the cost. Returns the moves {(source, destination): path}, the costs of the greedy and of the
+    # solved placement, or None when solver_time_budget runs out.
+    started = default_timer()
+    penalty = 2 * len(current_routing) + 2  # more than any balancing gain of a flow
+    paths = usable_paths()  # no flow is moved onto a path which is down
+    usable = frozenset(paths)
+
+    def add_cost(load):
+        # cost of a flow added to a path with load flows
+        if max_path_flows > 0 and load + 1 > max_path_flows:
+            return 2 * load + 1 + penalty
+        return 2 * load + 1
+
+    def placement_cost(flows):
+        return sum([sum([add_cost(load) for load in range(flows[path])]) for path in paths])
+
+    # movable flows grouped by (candidate paths, path before the solver, current path); the flows kept on their
+    # paths by the dwell time of the stability policy are counted but not moved, as are the flows left on a down path;
+    # the candidates of a flow are limited to the usable paths (those of an unspecified flow date from its placement)
+    flows = dict(current_flows)
+    groups = {}
+    for key, route in current_routing.iteritems():
+        if (reroute_dwell > 0 and now - route['since'] < reroute_dwell) or route['path'] not in usable:
+            continue
+        groups.setdefault((route_candidates[key] & usable, route['path'], route['path']), []).append(key)
+    greedy_cost = placement_cost(flows)
+
+    moves = {}
+    solved_cost = greedy_cost
+    while True:
+        if default_timer() - started > solver_time_budget:
+            return None
+        # cheapest move of one flow between two paths and the group it is taken from
+        cost = dict([(p, dict([(q, 0.0 if p == q else None) for q in paths])) for p in paths])
+        group_of = {}
+        for group, keys in groups.iteritems():
+            candidates, home, path = group
+            if keys == []:
+                continue
+            for q in candidates:
+                if q == path:
+                    continue
+                move = (0.0 if q == home else flow_move_cost) - (0.0 if path == home else flow_move_cost)
+                if cost[path][q] is None or move < cost[path][q]:
+                    cost[path][q] = move
+                    group_of[(path, q)] = group
+        hop = dict([(p, dict([(q, q) for q in paths])) for p in paths])
+        for m in paths:
+            for p in paths:
+                if cost[p][m] is None:
+                    continue
+                for q in paths:
+                    if cost[m][q] is not None and (cost[p][q] is None or cost[p][m] + cost[m][q] < cost[p][q]):
+                        cost[p][q] = cost[p][m] + cost[m][q]
+                        hop[p][q] = hop[p][m]
+
+        # the chain with the largest decrease of the cost
+        best = None
+        for p in paths:
+            if flows[p] == 0:
+                continue
+            for q in paths:
+                if p != q and cost[p][q] is not None:
+                    change = cost[p][q] + add_cost(flows[q]) - add_cost(flows[p] - 1)
+                    if change < 0 and (best is None or change < best[0]):
+                        best = (change, p, q)
+        if best is None:
+            break
+
+        # the chain is followed hop by hop; a chain which is not simple (Floyd-Warshall over a negative cycle) ends the search
+        change, p, q = best
+        chain = [p]
+        while chain[-1] != q and len(chain) <= len(paths):
+            chain.append(hop[chain[-1]][q])
+        if chain[-1] != q or len(set(chain)) != len(chain) or \
+                [hop_pair for hop_pair in zip(chain, chain[1:]) if hop_pair not in group_of] != []:
+            break
+        # as many flows are moved along the chain as its groups hold and each of them still lowers the cost
+        units = min([len(groups[group_of[hop_pair]]) for hop_pair in zip(chain, chain[1:])])
+        count = 1
+        while count < units and cost[p][q] + add_cost(flows[q] + count) - add_cost(flows[p] - 1 - count) < 0:
+            count += 1
+        for a, b in zip(chain, chain[1:]):
+            candidates, home, path = group_of[(a, b)]
+            for unit in range(count):
+                key = groups[(candidates, home, path)].pop()
+                groups.setdefault((candidates, home, b), []).append(key)
+                if b == home:
+                    del moves[key]
+                else:
+                    moves[key] = b
+        flows[p] -= count
+        flows[q] += count
+        solved_cost = placement_cost(flows) + flow_move_cost * len(moves)
+    return moves, greedy_cost, solved_cost
+
+
+def rebalance_routes(transaction, now, path_delay, reroutes):
+    # applies the placement of the solver in place of the greedy one; its moves go through the stability policy like
+    # those of the greedy placement (hold_route(), with the reroutes of the cycle so far counted against reroute_limit,
+    # an unspecified flow has no delay bound), so only a part of the solved placement may be applied;
+    # returns the number of moved flows
+    started = default_timer()
+    result = solve_placement(now)
+    if result is None:
+        print "Solver: time budget of", solver_time_budget * 1000, "[ms] exceeded, the greedy placement is kept"
+        return 0
+    moves, greedy_cost, solved_cost = result
+    usable = frozenset(path_delay)
+    held = 0
+    for key, path in sorted(moves.iteritems()):
+        route = current_routing[key]
+        intent = route['intent'] if key not in other_intents else {'delay': float('inf')}
+        if hold_route(intent, route, route_candidates[key] & usable, path, path_delay, now, reroutes):
+            held += 1
+            continue
+        reroutes += 1
+        current_flows[route['path']] -= 1
+        current_flows[path] += 1
+        current_routing[key] = {'intent': route['intent'], 'path': path, 'since': now}
+        if key in other_intents:
+            modify_flow(key[0], key[1], path, transaction, flow_idle_timeout)
+        else:
+            modify_flow(key[0], key[1], path, transaction)
+    gap = 100.0 * (greedy_cost - solved_cost) / greedy_cost if greedy_cost > 0 else 0.0
+    print "Solver:", len(moves) - held, "flows moved,", held, "held by the stability policy; cost of the greedy placement:", \
+        greedy_cost, "; solved:", solved_cost, "(" + str(round(gap, 1)) + "% lower) in", \
+        round((default_timer() - started) * 1000, 1), "[ms]"
+    return len(moves) - held
 
 
 def intent_routing():
-    global intents, current_routing, s1s2_delay_link, s1s3_delay_link, s1s4_delay_link
+    # Incremental placement: an intent is placed again only when the set of its candidate paths (the paths meeting its
+    # delay bound, or the lowest delay path if none does) has changed since the last delay update, or it is not routed yet.
+    # The routing table is indexed by (source, destination), so every step is a dictionary lookup instead of a scan.
+    global intents, current_routing, route_candidates
     global default_route_s1, default_route_s5, current_flows, other_intents, current_delays
 
-    new_current_routing = []
-    new_current_flows = {'s2': 0, 's3': 0, 's4': 0}
+    if topology_mode == 'discovery':
+        update_paths(path_change_margin)  # the paths follow the measured delays of the links
+
+    if usable_paths() == []:
+        return  # no path between the edge switches is known yet (or all of them are down)
+
     delays = []
-    delays.append({'path': 's2', 'delay': s1s2_delay_link})
-    delays.append({'path': 's3', 'delay': s1s3_delay_link})
-    delays.append({'path': 's4', 'delay': s1s4_delay_link})
+    for path in usable_paths():
+        delays.append({'path': path, 'delay': get_link_delay(path)})
 
     delays = sorted(delays, key=itemgetter('delay'), reverse=True)
     current_delays = delays
-    intents = sorted(intents, key=itemgetter('delay'))
 
+    # all flow mods of this pass are written to the switches in one batch per switch
+    transaction = FlowModTransaction('routing', PRIORITY_REROUTE)
+
+    # the candidate paths of a delay bound are the first k paths in the order of increasing delay
+    # (k >= 1, the lowest delay path is the candidate when no path meets the bound); k is found by bisection
+    ascending = [delay['path'] for delay in reversed(delays)]
+    ascending_delays = [delay['delay'] for delay in reversed(delays)]
+    prefix_by_bound = {}
+    candidate_sets = {}  # k -> set of the first k paths
+    changed_intents = []
     for intent in intents:
-        optimal_path = None
-        possible_path = []
-        for x, delay in enumerate(delays):
-            if delay['delay'] < intent['delay']:
-                possible_path.append(delay)
-            if x + 1 == len(delays) and possible_path == []:
-                optimal_path = delay['path']
-                new_current_flows[optimal_path] += 1
-                new_current_routing.append({'intent': intent, 'path': optimal_path})
-                break
-        if possible_path != []:
-            possible_path = sorted(possible_path, key=itemgetter('delay'), reverse=True)
-            best_path_flows = None
-            for x, path in enumerate(possible_path):
-                if x == 0 or new_current_flows[path['path']] <= best_path_flows:
-                    best_path_flows = new_current_flows[path['path']]
-                    optimal_path = path['path']
-            new_current_flows[optimal_path] += 1
-            new_current_routing.append({'intent': intent, 'path': optimal_path})
-
-    for flow in other_intents:
-        best_path_flows = None
-        optimal_path = None
-        for x, delay in enumerate(delays):
-            if x == 0 or new_current_flows[delay['path']] <= best_path_flows:
-                best_path_flows = new_current_flows[delay['path']]
-                optimal_path = delay['path']
-        new_current_flows[optimal_path] += 1
-        new_current_routing.append({'intent': flow, 'path': optimal_path})
-
-    for new_route in new_current_routing:
-        old_route_found = False
-        for route in current_routing:
-            if route['intent'] == new_route['intent']:
-                if route['path'] != new_route['path']:
-                    print "Changed routing path for intent: ", new_route
-                    print "Changed path: ", new_route['path']
-                    modify_flow(new_route['intent']['source'], new_route['intent']['destination'], new_route['path'])
-                old_route_found = True
-                break
-        if old_route_found is False:
+        k = prefix_by_bound.get(intent['delay'])
+        if k is None:
+            k = max(1, bisect_left(ascending_delays, intent['delay']))
+            prefix_by_bound[intent['delay']] = k
+            if k not in candidate_sets:
+                candidate_sets[k] = frozenset(ascending[:k])
+        key = (intent['source'], intent['destination'])
+        route = current_routing.get(key)
+        if route is None or route['intent'] is not intent or route_candidates[key] != candidate_sets[k] or \
+                route['path'] in down_paths:
+            changed_intents.append(intent)
+
+    # with the 'load' placement the measured load of the paths is projected as the intents are moved
+    loads = path_loads()
+    rates = {}
+    if loads is not None:
+        for intent in changed_intents:
+            key = (intent['source'], intent['destination'])
+            rates[key] = flow_rate(key)
+
+    # release the paths of the changed intents before placing them again, tightest delay bound first
+    for intent in changed_intents:
+        key = (intent['source'], intent['destination'])
+        route = current_routing.get(key)
+        if route is not None:
+            current_flows[route['path']] -= 1
+            if loads is not None:
+                loads[route['path']] -= rates[key]
+            if route['intent'] is not intent:
+                # an unspecified flow of the same hosts is taken over by the intent; a modify would keep the idle timeout
+                # of its entries, so they are deleted and installed again for the intent in the same transaction
+                del other_intents[key]
+                delete_flow(route, transaction)
+    changed_intents = sorted(changed_intents, key=itemgetter('delay'))
+
+    # the intents come in the order of increasing delay bounds, so their candidate prefixes only grow:
+    # the paths enter the heap once, as the first intent which may use them is placed (O(N log P) for N intents and P paths)
+    now = time.time()
+    path_delay = dict([(delay['path'], delay['delay']) for delay in delays])
+    heap = PathHeap(path_delay, current_flows, loads)
+    pushed = 0
+    reroutes = 0
+    held_routes = 0
+    for intent in changed_intents:
+        key = (intent['source'], intent['destination'])
+        k = prefix_by_bound[intent['delay']]
+        while pushed < k:
+            heap.push(ascending[pushed])
+            pushed += 1
+        candidates = candidate_sets[k]
+        optimal_path = heap.top()
+        route = current_routing.get(key)
+        if route is not None and route['intent'] is intent and route['path'] != optimal_path and \
+                hold_route(intent, route, candidates, optimal_path, path_delay, now, reroutes):
+            # the stability policy keeps the intent on its path; its candidates are checked again in the next cycle
+            current_flows[route['path']] += 1
+            if loads is not None:
+                loads[route['path']] += rates[key]
+            heap.update(route['path'])
+            held_routes += 1
+            continue
+        current_flows[optimal_path] += 1
+        if loads is not None:
+            loads[optimal_path] += rates[key]
+        heap.update(optimal_path)
+        new_route = {'intent': intent, 'path': optimal_path, 'since': now}
+        current_routing[key] = new_route
+        route_candidates[key] = candidates
+        if route is None or route['intent'] is not intent:
             print "New routing path for intent: ", new_route
             print "New path: ", new_route['path']
-            modify_flow(new_route['intent']['source'], new_route['intent']['destination'], new_route['path'])
-
-    current_routing = new_current_routing
-    current_flows = new_current_flows
-    print "\nCurrent flows: S2: ", current_flows['s2'], "; S3: ", current_flows['s3'], "; S4: ", current_flows['s4']
-    print "Current routing: "
-    for routing in current_routing:
-        print routing
+            modify_flow(intent['source'], intent['destination'], optimal_path, transaction)
+        elif route['path'] != optimal_path:
+            print "Changed routing path for intent: ", new_route
+            print "Changed path: ", new_route['path']
+            modify_flow(intent['source'], intent['destination'], optimal_path, transaction)
+            reroutes += 1
+        else:
+            new_route['since'] = route['since']
+    if solver_mode == 'mcf':
+        reroutes += rebalance_routes(transaction, now, path_delay, reroutes)
+    moved_subflows = move_subflows(transaction)
+    if backup_mode:
+        compute_backup_paths(transaction)
+    transaction.commit()
+
+    print "\nCurrent flows:", print_paths(current_flows)
+    if forecast_mode:
+        print "Routing delays with forecast [ms]:", print_paths(dict([(path, round(delay, 1)) for path, delay in path_delay.iteritems()])), \
+            "; trends [ms/s]:", print_paths(dict([(path, round(link_delay[path].trend, 2)) for path in path_delay]))
+    print "Current load [Mbit/s]:", print_paths(dict([(path, round(path_load[path].bps / 1e6, 2)) for path in measured_paths]))
+    if path_delay_mode != 'first_hop':
+        # both sums of the links, whichever of them the routing uses
+        sums = dict([(path, "-") for path in measured_paths])
+        for path, (oneway, rtt) in path_delays.iteritems():
+            sums[path] = str(round(oneway, 1)) + "/" + str(round(rtt, 1))
+        print "Path delays [ms one-way/round trip]:", print_paths(sums)
+    if held_routes > 0:
+        print "Rerouted intents:", reroutes, "; held on their paths by the stability policy:", held_routes
+    if multipath_mode:
+        subflow_counts = dict([(path, 0) for path in measured_paths])
+        for paths in subflows.itervalues():
+            for path in paths.itervalues():
+                subflow_counts[path] += 1
+        print "Current sub-flows:", print_paths(subflow_counts), "; moved:", moved_subflows
+    if changed_intents != [] and len(current_routing) <= routing_print_limit:
+        print "Current routing: "
+        for routing in current_routing.itervalues():
+            print routing
     print "\n"
 
-    if delays[-1]['path'] == 's2':
-        default_route_s1 = 4
-        default_route_s5 = 1
-    elif delays[-1]['path'] == 's3':
-        default_route_s1 = 5
-        default_route_s5 = 2
-    elif delays[-1]['path'] == 's4':
-        default_route_s1 = 6
-        default_route_s5 = 3
+    # ARP packets between the edges follow the lowest delay path
+    default_route_s1, default_route_s5 = path_ports[delays[-1]['path']]
+
+    print_flow_rates()
+    queued = sum([len(bucket.queued) for bucket in message_buckets.itervalues()])
+    if coalesced_packet_ins > 0 or queued > 0:
+        print "Duplicate packet-ins coalesced:", coalesced_packet_ins, "; flow mods waiting for the rate limit:", queued
+    request_flow_stats()
 
 
-#probe protocol packet definition; only timestamp field is present in the header (no payload part)
+def request_flow_stats():
+    # one flow stats request per edge switch and routing cycle: s1 counts the flows forward, s5 in the reverse direction
+    for dpid in (s1_dpid, s5_dpid):
+        if dpid <> 0 and not core.openflow.getConnection(dpid) is None:
+            core.openflow.getConnection(dpid).send(of.ofp_stats_request(body=of.ofp_flow_stats_request(match=of.ofp_match(dl_type=0x0800))))
+
+
+def print_flow_rates(count=5):
+    # monitoring: the heaviest routed flows
+    heaviest = sorted([(meter.bps, key) for key, meter in forward_rates.iteritems()], reverse=True)[:count]
+    if heaviest != [] and heaviest[0][0] > 0:
+        print "Heaviest flows [Mbit/s forward/reverse]:"
+        for bps, key in heaviest:
+            reverse = reverse_rates.get(key)
+            print "   ", key[0], "->", key[1], ":", round(bps / 1e6, 2), "/", round(reverse.bps / 1e6 if reverse is not None else 0.0, 2)
+
+
+#probe protocol packet definition; the header carries the timestamp and the id of the measured path (no payload part)
 class myproto(packet_base):
     #My Protocol packet struct
     """
     myproto class defines our special type of packet to be sent all the way along including the link between the switches to measure link delays;
-    it adds member attribute named timestamp to carry packet creation/sending time by the controller, and defines the
-    function hdr() to return the header of measurement packet (header will contain timestamp)
+    it adds member attribute named timestamp to carry packet creation/sending time by the controller and member attribute named probe_id
+    to identify the measured path when the probe comes back, and defines the function hdr() to return the header of measurement packet
+    (header will contain timestamp and probe id)
     """
     #For more info on packet_base class refer to file pox/lib/packet/packet_base.py
 
     def __init__(self):
         packet_base.__init__(self)
         self.timestamp=0
+        self.probe_id=0
 
     def hdr(self, payload):
-        return struct.pack('!I', self.timestamp) # code as unsigned int (I), network byte order (!, big-endian - the most significant byte of a word at the smallest memory address)
+        return struct.pack('!IH', self.timestamp, self.probe_id) # code as unsigned int (I) and unsigned short (H), network byte order (!, big-endian - the most significant byte of a word at the smallest memory address)
 
 
 def getTheTime():  # function to create a timestamp
@@ -316,107 +1725,286 @@ def getTheTime():  # function to create a timestamp
     return then
 
 
-def _timer_func():
-    global s1_dpid, start_time, turn, first_iter, OWD1_send_time
+def get_path_dpid(path):
+    # returns the DPID of the first interior switch of the path, where its probes come back (0 if it has not connected yet)
+    hops = path_hops.get(path)
+    if hops is None:
+        return 0
+    return switch_dpid(hops[1])
 
-    # measuring S1-S2 link
-    global s1s2_sent_time2, s2_dpid
 
-    # the following executes only when a connection to 'switch0' exists (otherwise AttributeError can be raised)
-    if s1_dpid <> 0 and not core.openflow.getConnection(s1_dpid) is None and turn == 0:
-        # send out port_stats_request packet through switch0 connection src_dpid (to measure T1)
-        core.openflow.getConnection(s1_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        OWD1_send_time = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch0
-        # print "sent_time1:", s1s2_sent_time1
-
-        # sequence of packet formating operations optimised to reduce the delay variation of e-2-e measurements (to measure T3)
-        f = myproto()  # create a probe packet object
-        e = pkt.ethernet()  # create L2 type packet (frame) object
-        e.src = EthAddr("0:0:0:0:0:2")
-        e.dst = EthAddr("0:1:0:0:0:1")
-        e.type = 0x5577  # set unregistered EtherType in L2 header type field, here assigned to the probe packet type
-        msg = of.ofp_packet_out()  # create PACKET_OUT message object
-        msg.actions.append(of.ofp_action_output(port=4))  # set the output port for the packet in switch0
-        f.timestamp = int(time.time() * 1000 * 10 - start_time) # set the timestamp in the probe packet
-        # print f.timestamp
-        e.payload = f
-        msg.data = e.pack()
-        core.openflow.getConnection(s1_dpid).send(msg)
-        #print "=====> S1-S2 probe sent: f=", f.timestamp, " after=", int(time.time() * 1000 * 10 - start_time), " [10*ms]"
-
-    # the following executes only when a connection to 'switch1' exists (otherwise AttributeError can be raised)
-    if s2_dpid <> 0 and not core.openflow.getConnection(s2_dpid) is None and turn == 0:
-        # send out port_stats_request packet through switch1 connection dst_dpid (to measure T2)
-        core.openflow.getConnection(s2_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        s1s2_sent_time2 = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch1
-        # print "sent_time2:", sent_time2
-
-    # measuring S1-S3 link
-    global s1s3_sent_time2, s3_dpid
+def compile_probe(path):
+    # packs the PACKET_OUT message of the path's probe once; the timestamp (the first field of the probe header)
+    # is left as zero and is overwritten in place by send_probe(); path may also be a link (switch, neighbour switch),
+    # whose probe is sent out of the switch towards the neighbour
+    if isinstance(path, tuple):
+        port, probe_id = adjacency[path[0]][path[1]], segment_ids[path]
+    else:
+        port, probe_id = path_ports[path][0], probe_ids[path]
+    f = myproto()  # create a probe packet object
+    e = pkt.ethernet()  # create L2 type packet (frame) object
+    e.src = EthAddr("0:0:0:0:0:2")
+    e.dst = EthAddr("0:1:0:0:0:1")
+    e.type = 0x5577  # set unregistered EtherType in L2 header type field, here assigned to the probe packet type
+    msg = of.ofp_packet_out()  # create PACKET_OUT message object
+    msg.actions.append(of.ofp_action_output(port=port))  # set the output port for the packet in switch0
+    f.probe_id = probe_id  # the id lets the reply be matched to its path
+    e.payload = f
+    msg.data = e.pack()
+    frame = bytearray(msg.pack())
+    probe_frames[path] = frame
+    return frame
+
+
+def send_probe(connection, path):
+    # only the timestamp is written into the preallocated probe message right before it is sent,
+    # which keeps the delay variation of e-2-e measurements (to measure T3) low
+    frame = probe_frames.get(path)
+    if frame is None:
+        frame = compile_probe(path)
+    struct.pack_into('!I', frame, len(frame) - 6, int(time.time() * 1000 * 10 - start_time))  # set the timestamp in the probe packet
+    struct.pack_into('!L', frame, 4, of.generate_xid())  # and a new xid in the PACKET_OUT
+    connection.send(bytes(frame))
+    if message_rate_limit > 0:
+        message_bucket(connection.dpid).tokens -= 1  # PRIORITY_PROBE: sent at once, but counted
+    #print "=====> S1-" + path.upper() + " probe sent: after=", int(time.time() * 1000 * 10 - start_time), " [10*ms]"
+
+
+def send_echo(dpid):
+    # echo request carrying its sending time; the switch returns the payload unchanged in the echo reply
+    connection = core.openflow.getConnection(dpid)
+    if dpid <> 0 and connection is not None:
+        connection.send(of.ofp_echo_request(body=struct.pack('!d', time.time())))
+
+
+def hook_echo_reply(connection):
+    # POX consumes echo replies without raising an event, so the OFPT_ECHO_REPLY entry of the handler table is wrapped:
+    # the table of the connection in newer POX versions, the module table of of_01 in older ones; False if there is none
+    handlers = getattr(connection, 'handlers', None)
+    if isinstance(handlers, list):
+        handlers = list(handlers)  # the table is shared by all connections, the copy belongs to this connection only
+        connection.handlers = handlers
+    else:
+        handlers = getattr(of_01, 'handlers', None)
+    if not isinstance(handlers, list) or len(handlers) <= of.OFPT_ECHO_REPLY:
+        return False
+    default = handlers[of.OFPT_ECHO_REPLY]
+    if getattr(default, 'echo_hook', False):
+        return True  # the module table is already wrapped
+
+    def handle_echo_reply(con, msg):
+        _handle_echo_reply(con, msg)
+        if default is not None:
+            default(con, msg)
+
+    handle_echo_reply.echo_hook = True
+    handlers[of.OFPT_ECHO_REPLY] = handle_echo_reply
+    return True
+
+
+def _handle_echo_reply(connection, msg):
+    # the replies to the keepalive echo requests of POX have no timestamp and are skipped
+    received = time.time()
+    if len(msg.body) < 8:
+        return
+    sent, = struct.unpack('!d', msg.body[:8])
+    history = switch_rtt.get(connection.dpid)
+    if history is None:
+        history = DelayHistory(history_size, history_alpha)
+        switch_rtt[connection.dpid] = history
+    history.add((received - sent) * 1000 * 10)
+
+
+def control_owd(dpid, portstats_owd):
+    # one-way delay [ms*10] of the control channel of the switch; the port stats estimate is used
+    # until the first echo reply of the switch arrives (or if the echo replies cannot be hooked)
+    history = switch_rtt.get(dpid)
+    if latency_mode == 'echo' and history is not None and history.count > 0:
+        return 0.5 * history.ewma
+    return portstats_owd
+
+
+def poll_port_stats():
+    # in the echo mode the port stats of s1 only measure the load of the paths, on a slower schedule than the probes
+    global OWD1_send_time, port_stats_time
+    connection = core.openflow.getConnection(s1_dpid)
+    now = time.time()
+    if s1_dpid == 0 or connection is None or now - port_stats_time < port_stats_interval:
+        return
+    port_stats_time = now
+    connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+    OWD1_send_time = now * 1000 * 10 - start_time
+
+
+def measure_paths(paths):
+    # measures the S1-SX links of the given paths: a single port_stats_request to s1 (T1) is shared by all the probes
+    # (in the echo mode an echo request to s1 and to each middle switch is sent instead)
+    global OWD1_send_time, link_sent_time2
 
     # the following executes only when a connection to 'switch0' exists (otherwise AttributeError can be raised)
-    if s1_dpid <> 0 and not core.openflow.getConnection(s1_dpid) is None and turn == 1:
-        # send out port_stats_request packet through switch0 connection src_dpid (to measure T1)
-        core.openflow.getConnection(s1_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        OWD1_send_time = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch0
-        # print "sent_time1:", sent_time1
-        # sequence of packet formating operations optimised to reduce the delay variation of e-2-e measurements (to measure T3)
-        f = myproto()  # create a probe packet object
-        e = pkt.ethernet()  # create L2 type packet (frame) object
-        e.src = EthAddr("0:0:0:0:0:2")
-        e.dst = EthAddr("0:1:0:0:0:1")
-        e.type = 0x5577  # set unregistered EtherType in L2 header type field, here assigned to the probe packet type
-        msg = of.ofp_packet_out()  # create PACKET_OUT message object
-        msg.actions.append(of.ofp_action_output(port=5))  # set the output port for the packet in switch0
-        f.timestamp = int(time.time() * 1000 * 10 - start_time)  # set the timestamp in the probe packet
-        # print f.timestamp
-        e.payload = f
-        msg.data = e.pack()
-        core.openflow.getConnection(s1_dpid).send(msg)
-        #print "=====> S1-S3 probe sent: f=", f.timestamp, " after=", int(time.time() * 1000 * 10 - start_time), " [10*ms]"
-
-    # the following executes only when a connection to 'switch1' exists (otherwise AttributeError can be raised)
-    if s3_dpid <> 0 and not core.openflow.getConnection(s3_dpid) is None and turn == 1:
-        # send out port_stats_request packet through switch1 connection dst_dpid (to measure T2)
-        core.openflow.getConnection(s3_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        s1s3_sent_time2 = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch1
-        # print "sent_time2:", sent_time2
-
-    # measuring S1-S4 link
-    global s1s4_sent_time2, s4_dpid
+    if s1_dpid == 0 or core.openflow.getConnection(s1_dpid) is None:
+        return
+    connection = core.openflow.getConnection(s1_dpid)
+
+    if path_delay_mode != 'first_hop':
+        measure_segments(paths)
+        return
+
+    if latency_mode == 'echo':
+        send_echo(s1_dpid)
+        for path in paths:
+            send_echo(get_path_dpid(path))
+        for path in paths:
+            send_probe(connection, path)
+        return
+
+    # send out port_stats_request packet through switch0 connection src_dpid (to measure T1)
+    connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+    OWD1_send_time = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch0
+
+    for path in paths:
+        # the following executes only when a connection to 'switch1' exists (otherwise AttributeError can be raised)
+        dpid = get_path_dpid(path)
+        if dpid <> 0 and not core.openflow.getConnection(dpid) is None:
+            # send out port_stats_request packet through switch1 connection dst_dpid (to measure T2)
+            core.openflow.getConnection(dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+            link_sent_time2[path] = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch1
+
+    # probes are sent back to back, each of them carries the id of its path
+    for path in paths:
+        send_probe(connection, path)
+
+
+def path_segments(path):
+    # links of the path from s1 to s5, and the links of the way back
+    hops = path_hops.get(path, [])
+    forward = zip(hops, hops[1:])
+    return forward, [(b, a) for a, b in reversed(forward)]
+
+
+def measure_segments(paths):
+    # measures every link of the given paths in both directions: a probe sent out of a switch towards its neighbour comes
+    # back in a PACKET_IN of the neighbour; the control channel latency of every switch involved is measured with the probes
+    # by a port stats request (an echo request in the echo mode), and a link shared by several paths is probed once
+    segments = []
+    for path in paths:
+        forward, reverse = path_segments(path)
+        pending_segments[path] = set(forward + reverse)
+        segments.extend([segment for segment in forward + reverse if segment not in segments])
+    dpids = []
+    for segment in segments:
+        for dpid in (switch_dpid(segment[0]), switch_dpid(segment[1])):
+            if dpid <> 0 and dpid not in dpids and core.openflow.getConnection(dpid) is not None:
+                dpids.append(dpid)
+    for dpid in dpids:
+        if latency_mode == 'echo':
+            send_echo(dpid)
+        else:
+            core.openflow.getConnection(dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+            stats_sent_time[dpid] = time.time() * 1000 * 10 - start_time
+    for segment in segments:
+        if segment not in segment_ids:
+            segment_ids[segment] = 0x8000 + len(segment_ids)  # above the ids of the paths
+            segment_probes[segment_ids[segment]] = segment
+        connection = core.openflow.getConnection(switch_dpid(segment[0]))
+        if switch_dpid(segment[0]) <> 0 and connection is not None:
+            send_probe(connection, segment)
+
+
+def segment_measured(segment):
+    # a path whose links have all come back in this round gets a new delay sample: the sum of its links from s1 to s5
+    # ('oneway') or of the round trip ('rtt')
+    for path, pending in pending_segments.items():
+        if segment not in pending:
+            continue
+        pending.discard(segment)
+        if pending:
+            continue
+        del pending_segments[path]
+        forward, reverse = path_segments(path)
+        oneway = sum([segment_delay[link] for link in forward])
+        rtt = oneway + sum([segment_delay[link] for link in reverse])
+        path_delays[path] = (oneway, rtt)
+        link_delay[path].add(oneway if path_delay_mode == 'oneway' else rtt)
+        print path.upper(), "path delay:", oneway, "[ms] one-way;", rtt, "[ms] round trip; estimated (" + delay_estimator + "):", \
+            get_link_delay(path), "[ms]"
+        if probe_mode == 'adaptive':
+            adapt_probe_period(path)
+
+
+def adapt_probe_period(path):
+    # the urgency (0 to 1) of a path grows with the variation of its delay samples and with its proximity to a delay bound;
+    # the period goes linearly from max_probe_interval (urgency 0) down to probe_interval (urgency 1), or between the limits
+    # of the path in path_probe_limits
+    history = link_delay[path]
+    if history.count < 2:
+        return
+    urgency = 0.0
+    if probe_jitter_limit > 0:
+        urgency = min(1.0, history.stddev() / probe_jitter_limit)
+    if probe_slack_limit > 0 and intents:
+        delay = get_link_delay(path)
+        slack = min([abs(intent['delay'] - delay) for intent in intents])
+        urgency = max(urgency, 1.0 - min(1.0, slack / probe_slack_limit))
+    min_period, max_period = path_probe_limits.get(path, (probe_interval, max_probe_interval))
+    period = max_period - urgency * (max_period - min_period)
+    if abs(period - path_probe_period.get(path, probe_interval)) >= probe_interval:
+        print "S1-" + path.upper() + " probe period:", round(period, 1), "[s]"
+    path_probe_period[path] = period
+    next_probe_time[path] = last_probe_time.get(path, 0.0) + period
+
+
+def schedule_probes():
+    # paths whose probe period has elapsed, the longest overdue first, as many as probe_rate_limit allows
+    # (a path is due within half a tick, so the jitter of the timer does not delay it by a whole tick)
+    global probe_credit
+    now = time.time()
+    due = [path for path in usable_paths() if next_probe_time.get(path, 0.0) <= now + 0.5 * probe_interval]
+    due.sort(key=lambda path: next_probe_time.get(path, 0.0))
+    if probe_rate_limit > 0:
+        allowance = probe_rate_limit * probe_interval
+        probe_credit = min(probe_credit + allowance, max(1.0, allowance))
+        due = due[:int(probe_credit)]
+        probe_credit -= len(due)
+    for path in due:
+        last_probe_time[path] = now
+        next_probe_time[path] = now + path_probe_period.get(path, path_probe_limits.get(path, (probe_interval,))[0])
+    return due
 
-    # the following executes only when a connection to 'switch0' exists (otherwise AttributeError can be raised)
-    if s1_dpid <> 0 and not core.openflow.getConnection(s1_dpid) is None and turn == 2:
-        # send out port_stats_request packet through switch0 connection src_dpid (to measure T1)
-        core.openflow.getConnection(s1_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        OWD1_send_time = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch0
-        # print "sent_time1:", sent_time1
-        # sequence of packet formating operations optimised to reduce the delay variation of e-2-e measurements (to measure T3)
-        f = myproto()  # create a probe packet object
-        e = pkt.ethernet()  # create L2 type packet (frame) object
-        e.src = EthAddr("0:0:0:0:0:2")
-        e.dst = EthAddr("0:1:0:0:0:1")
-        e.type = 0x5577  # set unregistered EtherType in L2 header type field, here assigned to the probe packet type
-        msg = of.ofp_packet_out()  # create PACKET_OUT message object
-        msg.actions.append(of.ofp_action_output(port=6))  # set the output port for the packet in switch0
-        f.timestamp = int(time.time() * 1000 * 10 - start_time)  # set the timestamp in the probe packet
-        # print f.timestamp
-        e.payload = f
-        msg.data = e.pack()
-        core.openflow.getConnection(s1_dpid).send(msg)
-        #print "=====> S1-S4 probe sent: f=", f.timestamp, " after=", int(time.time() * 1000 * 10 - start_time), " [10*ms]"
-
-    # the following executes only when a connection to 'switch1' exists (otherwise AttributeError can be raised)
-    if s4_dpid <> 0 and not core.openflow.getConnection(s4_dpid) is None and turn == 2:
-        # send out port_stats_request packet through switch1 connection dst_dpid (to measure T2)
-        core.openflow.getConnection(s4_dpid).send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-        s1s4_sent_time2 = time.time() * 1000 * 10 - start_time  # sending time of stats_req: ctrl => switch1
-        # print "sent_time2:", sent_time2
-
-    if turn == 3:
+
+def _timer_func():
+    global turn, probe_tick
+
+    if latency_mode == 'echo':
+        poll_port_stats()
+
+    if probe_mode == 'adaptive':
+        paths = schedule_probes()
+        if paths:
+            measure_paths(paths)
+        probe_tick += 1
+        if probe_tick >= routing_ticks:
+            probe_tick = 0
+            intent_routing()
+        return
+
+    if probe_mode == 'concurrent':
+        # all paths are measured in every tick; the routing runs on its own cadence
+        measure_paths(usable_paths())
+        probe_tick += 1
+        if probe_tick >= routing_ticks:
+            probe_tick = 0
+            intent_routing()
+        return
+
+    # round robin: one path per tick, the routing in the tick following the last path
+    if turn < len(measured_paths):
+        if measured_paths[turn] not in down_paths:
+            measure_paths([measured_paths[turn]])
+    else:
         intent_routing()
 
-    if turn != 3:
+    if turn != len(measured_paths):
         turn += 1
     else:
         turn = 0
@@ -424,412 +2012,500 @@ def _timer_func():
 
 def _handle_portstats_received(event):
     # Observe the handling of port statistics provided by this function.
-    global s1_dpid, start_time, OWD1_send_time, OWD1_receive_time
+    global s1_dpid, start_time, OWD1_send_time, OWD1_receive_time, link_OWD2
     received_time = time.time() * 1000 * 10 - start_time
 
+    # control channel of a switch whose links are probed (path_delay_mode 'oneway' or 'rtt')
+    sent_time = stats_sent_time.pop(event.connection.dpid, None)
+    if sent_time is not None:
+        switch_owd[event.connection.dpid] = 0.5 * (received_time - sent_time)
+
     # measure T1 as of lab guide
     if event.connection.dpid == s1_dpid:
         OWD1_receive_time = 0.5 * (received_time - OWD1_send_time)
         # print "OWD1: ", OWD1_send_time, "ms"
 
-    # measuring S1-S2 link
-    global s1s2_sent_time2, s2_dpid, s1s2_OWD2
-
-    # measure T2 as of lab guide
-    if event.connection.dpid == s2_dpid:
-        s1s2_OWD2 = 0.5 * (received_time - s1s2_sent_time2)  # originally sent_time1 was here
-        # print "OWD2: ", OWD2, "ms"
-
-    # measuring S1-S3 link
-    global s1s3_sent_time2, s3_dpid, s1s3_OWD2
-
-    # measure T2 as of lab guide
-    if event.connection.dpid == s3_dpid:
-        s1s3_OWD2 = 0.5 * (received_time - s1s3_sent_time2)  # originally sent_time1 was here
-        # print "OWD2: ", OWD2, "ms"
+    # measure T2 as of lab guide (for S1-S2, S1-S3 and S1-S4 links)
+    for path in measured_paths:
+        if event.connection.dpid == get_path_dpid(path):
+            link_OWD2[path] = 0.5 * (received_time - link_sent_time2[path])  # originally sent_time1 was here
+            # print "OWD2: ", link_OWD2[path], "ms"
 
-    # measuring S1-S4 link
-    global s1s4_sent_time2, s4_dpid, s1s4_OWD2
+    # tx counters of the s1 ports towards the paths give the load of the paths
+    if event.connection.dpid == s1_dpid:  # The DPID of one of the switches involved in the link
+        now = time.time()
+        for f in event.stats:
+            for path in measured_paths:
+                if f.port_no == path_ports[path][0]:
+                    path_load[path].update(f.tx_bytes, f.tx_packets, now)
+                    # print path, "->","TxDrop:", f.tx_dropped,"RxDrop:",f.rx_dropped,"TxErr:",f.tx_errors,"CRC:",f.rx_crc_err,"Coll:",f.collisions,"Tx:",f.tx_packets,"Rx:",f.rx_packets
 
-    # measure T2 as of lab guide
-    if event.connection.dpid == s4_dpid:
-        s1s4_OWD2 = 0.5 * (received_time - s1s4_sent_time2)  # originally sent_time1 was here
-        # print "OWD2: ", OWD2, "ms"
 
-    global s1_p1, s1_p4, s1_p5, s1_p6, s2_p1, s3_p1, s4_p1
-    global pre_s1_p1, pre_s1_p4, pre_s1_p5, pre_s1_p6, pre_s2_p1, pre_s3_p1, pre_s4_p1
+def _handle_flowstats_received(event):
+    # per flow rates from the counters of the route entries (nw_src and nw_dst) of s1 and s5;
+    # the time of a reading is the duration of the entry, so the rates do not depend on the control channel delay
+    ofp = event.ofp[0] if isinstance(event.ofp, list) else event.ofp  # the first part of a multipart reply
+    if reconcile_xids.get(event.connection.dpid) == ofp.xid:
+        reconcile_flow_table(event.connection.dpid, event.stats)
 
-    if event.connection.dpid == s1_dpid:  # The DPID of one of the switches involved in the link
-        for f in event.stats:
-            if int(f.port_no) < 65534:
-                if f.port_no == 4:
-                    pre_s1_p4 = s1_p4
-                    s1_p4 = f.tx_packets
-                    # print "s1_p4->","TxDrop:", f.tx_dropped,"RxDrop:",f.rx_dropped,"TxErr:",f.tx_errors,"CRC:",f.rx_crc_err,"Coll:",f.collisions,"Tx:",f.tx_packets,"Rx:",f.rx_packets
-                if f.port_no == 5:
-                    pre_s1_p5 = s1_p5
-                    s1_p5 = f.tx_packets
-                if f.port_no == 6:
-                    pre_s1_p6 = s1_p6
-                    s1_p6 = f.tx_packets
+    if event.connection.dpid == s1_dpid:
+        rates = forward_rates
+    elif event.connection.dpid == s5_dpid:
+        rates = reverse_rates
+    else:
+        return
+    # the counters of the sub-flow entries of a pair add up to those of its route entry; the route entry is the oldest one,
+    # so its duration times the readings
+    counters = {}  # (source, destination) -> [bytes, packets, duration]
+    for f in event.stats:
+        src = ip_hosts.get(f.match.nw_src)
+        dst = ip_hosts.get(f.match.nw_dst)
+        if src is None or dst is None:
+            continue  # not a route entry (e.g. a rule for the local hosts)
+        if rates is forward_rates:
+            key = (src, dst)
+        else:
+            key = (dst, src)  # the s5 entry of a route carries the reverse direction
+        counter = counters.setdefault(key, [0, 0, 0.0])
+        counter[0] += f.byte_count
+        counter[1] += f.packet_count
+        counter[2] = max(counter[2], f.duration_sec + f.duration_nsec / 1e9)
+    for key, (byte_count, packet_count, duration) in counters.iteritems():
+        meter = rates.get(key)
+        if meter is None:
+            meter = CounterRate()
+            rates[key] = meter
+        meter.update(byte_count, packet_count, duration)
+    # the flows without an entry in the switch any more are forgotten
+    for key in rates.keys():
+        if key not in counters:
+            del rates[key]
+
+
+def reconcile_flow_table(dpid, stats):
+    # the entries which the switch holds after a (re)connection enter its shadow table; the entries written since
+    # the flow stats request are newer, so they are kept
+    del reconcile_xids[dpid]
+    table = flow_tables.setdefault(dpid, {})
+    for f in stats:
+        table.setdefault(match_entry(f.match, f.priority),
+                         (f.idle_timeout, f.hard_timeout, tuple([a.port for a in f.actions if hasattr(a, 'port')])))
+    print "Shadow flow table of", switch_name(dpid) + ":", len(table), "entries;", \
+        redundant_flow_mods, "redundant flow mods suppressed so far"
 
 
 def _handle_ConnectionUp(event):
     # waits for connections from all switches, after connecting to all of them it starts a round robin timer for triggering h1-h4 routing changes
-    global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid
+    global s1_dpid, s5_dpid, timer_started
     print
     "ConnectionUp: ", dpidToStr(event.connection.dpid)
 
-    # remember the connection dpid for the switch
-    for m in event.connection.features.ports:
-        if m.name == "s1-eth1":
-            # s1_dpid: the DPID (datapath ID) of switch s1;
-            s1_dpid = event.connection.dpid
-            print "s1_dpid=", s1_dpid
-        elif m.name == "s2-eth1":
-            s2_dpid = event.connection.dpid
-            print "s2_dpid=", s2_dpid
-        elif m.name == "s3-eth1":
-            s3_dpid = event.connection.dpid
-            print "s3_dpid=", s3_dpid
-        elif m.name == "s4-eth1":
-            s4_dpid = event.connection.dpid
-            print "s4_dpid=", s4_dpid
-        elif m.name == "s5-eth1":
-            s5_dpid = event.connection.dpid
-            print "s5_dpid=", s5_dpid
-
-    # start 1-second recurring loop timer for round-robin routing changes; _timer_func is to be called on timer expiration to change the flow entry in s1
-    if s1_dpid <> 0 and s2_dpid <> 0 and s3_dpid <> 0 and s4_dpid <> 0 and s5_dpid <> 0:
-        Timer(1, _timer_func, recurring=True)
-
-
-def _handle_PacketIn(event):
-    global s1_dpid, s2_dpid, s3_dpid, s4_dpid, s5_dpid, start_time, OWD1_receive_time
-
-    packet = event.parsed
-    # print "_handle_PacketIn is called, packet.type:", packet.type, " event.connection.dpid:", event.connection.dpid
+    # the switch is known by its DPID; the edge switches are those of the lab (see ingress_switch and egress_switch)
+    dpid = event.connection.dpid
+    connected_switches.add(dpid)
+    print switch_name(dpid) + "_dpid=", dpid
+    register_packet_in_handlers(dpid)
+
+    # the shadow table of the switch starts empty and is completed from the entries the switch reports
+    # (it may have kept them over a reconnection)
+    flow_tables[event.connection.dpid] = {}
+    request = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+    reconcile_xids[event.connection.dpid] = request.xid
+    event.connection.send(request)
+    link_up([(dpid, None)])
+    if dpid == ingress_switch:
+        # s1_dpid: the DPID (datapath ID) of switch s1 once it has connected;
+        s1_dpid = dpid
+    elif dpid == egress_switch:
+        s5_dpid = dpid
+
+    # in the echo mode the round trip of the control channel is measured with echo requests
+    if latency_mode == 'echo' and not hook_echo_reply(event.connection):
+        log.warning("Echo replies of %s cannot be intercepted, port stats latency is used", dpidToStr(event.connection.dpid))
+
+    # in the proactive mode the static rules are written once, as soon as the switch has connected
+    # (so are the ARP rules in the 'proactive' ARP mode)
+    if proactive_mode or arp_mode == 'proactive':
+        transaction = FlowModTransaction('static')
+        if proactive_mode:
+            install_static_rules(event.connection.dpid, transaction)
+        if arp_mode == 'proactive':
+            install_arp_rules(event.connection.dpid, transaction)
+        transaction.commit()
+
+    # start recurring loop timer (probe_interval, 1 second by default) for link measurements and routing changes;
+    # _timer_func is to be called on timer expiration to measure the links and to change the flow entries in s1;
+    # the diamond waits for all its switches, a discovered topology for the edge switches (its links come later)
+    if s1_dpid <> 0 and s5_dpid <> 0 and not timer_started and \
+            (topology_mode == 'discovery' or [switch for switch in adjacency if switch not in connected_switches] == []):
+        timer_started = True
+        Timer(probe_interval, _timer_func, recurring=True)
+
+
+def probe_in(event, data):
+    # Process a probe packet received in PACKET_IN message from 'switch1' (dst_dpid), previously sent to 'switch0' (src_dpid) in PACKET_OUT;
+    # the timestamp and the probe id are read from the raw frame (behind the 14 bytes of the Ethernet header)
+    global OWD1_receive_time, link_OWD2
     received_time = time.time() * 1000 * 10 - start_time  # amount of time elapsed from start_time
 
-    # measuring S1-S2 link
-    global s1s2_OWD2, s1s2_delay_link
-
-    if packet.type == 0x5577 and event.connection.dpid == s2_dpid:  # 0x5577 is unregistered EtherType, here assigned to probe packets
-        # Process a probe packet received in PACKET_IN message from 'switch1' (dst_dpid), previously sent to 'switch0' (src_dpid) in PACKET_OUT.
-
-        c = packet.find('ethernet').payload
-        d, = struct.unpack('!I', c)  # note that d,=... is a struct.unpack and always returns a tuple
-        #print "[ms*10]: received_time=", int(received_time), ", d=", d, ", OWD1=", int(OWD1_send_time), ", OWD2=", int(s1s2_OWD2)
-        s1s2_delay_link = int(received_time - d - OWD1_receive_time - s1s2_OWD2) / 10
-        print "S1-S2 link delay:", s1s2_delay_link, "[ms]"  # divide by 10 to normalise to milliseconds
-
-    # measuring S1-S3 link
-    global s1s3_OWD2, s1s3_delay_link
-
-    if packet.type == 0x5577 and event.connection.dpid == s3_dpid:  # 0x5577 is unregistered EtherType, here assigned to probe packets
-        # Process a probe packet received in PACKET_IN message from 'switch1' (dst_dpid), previously sent to 'switch0' (src_dpid) in PACKET_OUT.
-
-        c = packet.find('ethernet').payload
-        d, = struct.unpack('!I', c)  # note that d,=... is a struct.unpack and always returns a tuple
-        #print "[ms*10]: received_time=", int(received_time), ", d=", d, ", OWD1=", int(OWD1_send_time), ", OWD2=", int(s1s3_OWD2)
-        s1s3_delay_link = int(received_time - d - OWD1_receive_time - s1s3_OWD2) / 10
-        print "S1-S3 link delay:", s1s3_delay_link, "[ms]"  # divide by 10 to normalise to milliseconds
-
-    # measuring S1-S4 link
-    global s1s4_OWD2, s1s4_delay_link
-
-    if packet.type == 0x5577 and event.connection.dpid == s4_dpid:  # 0x5577 is unregistered EtherType, here assigned to probe packets
-        # Process a probe packet received in PACKET_IN message from 'switch1' (dst_dpid), previously sent to 'switch0' (src_dpid) in PACKET_OUT.
-
-        c = packet.find('ethernet').payload
-        d, = struct.unpack('!I', c)  # note that d,=... is a struct.unpack and always returns a tuple
-        #print "[ms*10]: received_time=", int(received_time), ", d=", d, ", OWD1=", int(OWD1_send_time), ", OWD2=", int(s1s4_OWD2)
-        s1s4_delay_link = int(received_time - d - OWD1_receive_time - s1s4_OWD2) / 10
-        print "S1-S4 link delay:", s1s4_delay_link, "[ms]"  # divide by 10 to normalise to milliseconds
-
-
-    # Below, set the default/initial routing rules for all switches and ports.
-    # All rules are set up in a given switch on packet_in event received from the switch which means no flow entry has been found in the flow table.
-    # This setting up may happen either at the very first pactet being sent or after flow entry expirationn inn the switch
-
-    if event.connection.dpid == s1_dpid:
-        a = packet.find('arp')  # If packet object does not encapsulate a packet of the type indicated, find() returns None
-        if a and a.protodst == "10.0.0.4":
-            msg = of.ofp_packet_out(data=event.ofp)  # Create packet_out message; use the incoming packet as the data for the packet out
-            msg.actions.append(of.ofp_action_output(port=default_route_s1))  # Add an action to send to the specified port
-            event.connection.send(msg)  # Send message to switch
-
-        if a and a.protodst == "10.0.0.5":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=default_route_s1))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.6":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=default_route_s1))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.1":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=1))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.2":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=2))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.3":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=3))
-            event.connection.send(msg)
-
-        ip = packet.find('ipv4')
-        if ip and ip.dstip == "10.0.0.1":
-            msg = of.ofp_flow_mod()
-            msg.priority = 100
-            msg.idle_timeout = 0
-            msg.hard_timeout = 0
-            msg.match.dl_type = 0x0800  # rule for IP packets (x0800)
-            msg.match.nw_dst = "10.0.0.1"
-            msg.actions.append(of.ofp_action_output(port=1))
-            event.connection.send(msg)
-
-        if ip and ip.dstip == "10.0.0.2":
-            msg = of.ofp_flow_mod()
-            msg.priority = 100
-            msg.idle_timeout = 0
-            msg.hard_timeout = 0
-            msg.match.dl_type = 0x0800
-            msg.match.nw_dst = "10.0.0.2"
-            msg.actions.append(of.ofp_action_output(port=2))
-            event.connection.send(msg)
-
-        if ip and ip.dstip == "10.0.0.3":
-            msg = of.ofp_flow_mod()
-            msg.priority = 100
-            msg.idle_timeout = 0
-            msg.hard_timeout = 0
-            msg.match.dl_type = 0x0800
-            msg.match.nw_dst = "10.0.0.3"
-            msg.actions.append(of.ofp_action_output(port=3))
-            event.connection.send(msg)
-
-        if ip and (ip.dstip == "10.0.0.4" or ip.dstip == "10.0.0.5" or ip.dstip == "10.0.0.6"):
-            global other_intents, current_flows, current_delays, current_routing
-
-            src = None
-            if ip.srcip == "10.0.0.1":
-                src = 'h1'
-            elif ip.srcip == "10.0.0.2":
-                src = 'h2'
-            elif ip.srcip == "10.0.0.3":
-                src = 'h3'
-
-            dst = None
-            if ip.dstip == "10.0.0.4":
-                dst = 'h4'
-            elif ip.dstip == "10.0.0.5":
-                dst = 'h5'
-            elif ip.dstip == "10.0.0.6":
-                dst = 'h6'
-
-            unspecified_flow = {'source': src, 'destination': dst}
-            other_intents.append(unspecified_flow)
-
-            best_path_flows = None
-            optimal_path = None
-            for x, delay in enumerate(current_delays):
-                if x == 0 or current_flows[delay['path']] <= best_path_flows:
-                    best_path_flows = current_flows[delay['path']]
-                    optimal_path = delay['path']
-            current_flows[optimal_path] += 1
-            current_routing.append({'intent': unspecified_flow, 'path': optimal_path})
-
-            print "New routing path for unspecified flow: ", unspecified_flow
-            print "New path: ", optimal_path
-            print "\nCurrent flows: S2: ", current_flows['s2'], "; S3: ", current_flows['s3'], "; S4: ", current_flows['s4'], "\n"
-            modify_flow(src, dst, optimal_path)
-
-    elif event.connection.dpid == s2_dpid:
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0806  # rule for ARP packets (x0806)
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0806
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-    elif event.connection.dpid == s3_dpid:
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0806
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0806
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-    elif event.connection.dpid == s4_dpid:
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0806
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 1
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=2))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0806
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 10
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.in_port = 2
-        msg.match.dl_type = 0x0800
-        msg.actions.append(of.ofp_action_output(port=1))
-        event.connection.send(msg)
-
-    elif event.connection.dpid == s5_dpid:
-        a = packet.find('arp')
-        if a and a.protodst == "10.0.0.4":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=4))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.5":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=5))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.6":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=6))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.1":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=default_route_s5))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.2":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=default_route_s5))
-            event.connection.send(msg)
-
-        if a and a.protodst == "10.0.0.3":
-            msg = of.ofp_packet_out(data=event.ofp)
-            msg.actions.append(of.ofp_action_output(port=default_route_s5))
-            event.connection.send(msg)
+    if len(data) >= 20:
+        d, probe_id = struct.unpack_from('!IH', data, 14)  # note that struct.unpack always returns a tuple
+        path = probe_paths.get(probe_id)
+        # the probe id identifies the measured path; a probe which arrived at another switch is ignored
+        if path is not None and event.dpid == get_path_dpid(path):
+            #print "[ms*10]: received_time=", int(received_time), ", d=", d, ", OWD1=", int(OWD1_send_time), ", OWD2=", int(link_OWD2[path])
+            owd1 = control_owd(s1_dpid, OWD1_receive_time)
+            owd2 = control_owd(event.dpid, link_OWD2[path])
+            link_delay[path].add(int(received_time - d - owd1 - owd2) / 10)  # divide by 10 to normalise to milliseconds
+            segment_delay[(ingress_switch, path_hops[path][1])] = link_delay[path].last  # kept for update_paths()
+            print "S1-" + path.upper() + " link delay:", link_delay[path].last, "[ms]; estimated (" + delay_estimator + "):", get_link_delay(path), "[ms]"
+            if probe_mode == 'adaptive':
+                adapt_probe_period(path)
+        # the probe of a link comes back at the neighbour switch (path_delay_mode 'oneway' or 'rtt')
+        segment = segment_probes.get(probe_id)
+        if segment is not None and event.dpid == switch_dpid(segment[1]):
+            owd_a = control_owd(switch_dpid(segment[0]), switch_owd.get(switch_dpid(segment[0]), 0.0))
+            owd_b = control_owd(event.dpid, switch_owd.get(event.dpid, 0.0))
+            segment_delay[segment] = int(received_time - d - owd_a - owd_b) / 10
+            segment_measured(segment)
+    if event.dpid <> s1_dpid and event.dpid <> s5_dpid:
+        interior_packet_in(event, data)
+
+
+# Below, the default/initial routing rules for all switches and ports.
+# All rules are set up in a given switch on packet_in event received from the switch which means no flow entry has been found in the flow table.
+# This setting up may happen either at the very first pactet being sent or after flow entry expirationn inn the switch
+# (in the proactive mode the static rules are already in place, so packet_in is left to probes, ARP and new flows)
+
+def ingress_arp_in(event, data):
+    edge_arp(event, arp(raw=data[14:]), ingress_switch, default_route_s1)
+
+
+def ingress_ip_in(event, data):
+    # an IP packet at s1: the rule towards a local host, or the placement of a new flow towards s5;
+    # the hosts are looked up by the raw source and destination addresses of the IP header
+    global other_intents, current_flows, current_delays, current_routing, route_candidates
+    src = raw_ip_hosts.get(data[26:30])
+    dst = raw_ip_hosts.get(data[30:34])
+    # admission: the duplicate misses of a pair whose entries are being installed are coalesced into that install
+    if not admit_packet_in((src, dst)):
+        if (src, dst) in other_intents:
+            other_intents[(src, dst)] = other_intents.pop((src, dst))  # the flow is still the most recently seen one
+        return
+    if dst is not None and hosts[dst][1] == ingress_switch and not proactive_mode:
+        transaction = FlowModTransaction('flow')
+        forget_flow_mod(event.dpid, host_rule(dst))
+        send_flow_mod(event.dpid, host_rule(dst), transaction)  # rule for IP packets (x0800) to the local host
+        transaction.commit()
+        flow_installs[(src, dst)] = transaction
+
+    if dst is None or hosts[dst][1] != egress_switch or src is None or hosts[src][1] != ingress_switch or \
+            usable_paths() == []:
+        return
+
+    key = (src, dst)
+    route = current_routing.get(key)
+    if route is not None and multipath_mode and key not in other_intents:
+        new_subflow(event, data, key, route)
+        return
+    if route is not None:
+        # the flow is routed already (e.g. it is an intent whose flow entry is missing in the switch), so it is reinstalled
+        transaction = FlowModTransaction('flow')
+        if key in other_intents:
+            other_intents[key] = other_intents.pop(key)  # the flow becomes the most recently seen one
+            forget_flow(src, dst, route['path'], flow_idle_timeout)
+            modify_flow(src, dst, route['path'], transaction, flow_idle_timeout)
+        else:
+            forget_flow(src, dst, route['path'])
+            modify_flow(src, dst, route['path'], transaction)
+        transaction.commit()
+        flow_installs[key] = transaction
+        return
+
+    # the s1 and s5 flow entries of the pair are written in one transaction
+    transaction = FlowModTransaction('flow')
+
+    # the number of unspecified flows is bounded, the least recently seen ones are forgotten first
+    while len(other_intents) >= max_other_intents:
+        remove_unspecified_flow(next(iter(other_intents)), transaction)
+
+    unspecified_flow = {'source': src, 'destination': dst}
+    other_intents[key] = unspecified_flow
+
+    # unspecified flows may use any path; before the first routing the paths have not been ordered by delay yet
+    if current_delays != []:
+        optimal_path = least_loaded_path([delay['path'] for delay in current_delays], current_flows, path_loads())
+    else:
+        optimal_path = least_loaded_path(usable_paths(), current_flows, path_loads())
+    current_flows[optimal_path] += 1
+    current_routing[key] = {'intent': unspecified_flow, 'path': optimal_path, 'since': time.time()}
+    route_candidates[key] = frozenset(usable_paths())
+
+    print "New routing path for unspecified flow: ", unspecified_flow
+    print "New path: ", optimal_path
+    print "\nCurrent flows:", print_paths(current_flows), "\n"
+    modify_flow(src, dst, optimal_path, transaction, flow_idle_timeout)
+    transaction.commit()
+    flow_installs[key] = transaction
+
+
+def egress_arp_in(event, data):
+    edge_arp(event, arp(raw=data[14:]), egress_switch, default_route_s5)
+    egress_packet_in(event, data)
+
+
+def egress_packet_in(event, data):
+    # an IP packet to a local host shows that the host rules are missing; the other packets leave them to the shadow table
+    if not proactive_mode:
+        dst = raw_ip_hosts.get(data[30:34]) if data[12:14] == '\x08\x00' else None
+        install_static_rules(event.dpid, missing=dst is not None and hosts[dst][1] == egress_switch)
+
+
+def interior_arp_in(event, data):
+    if topology_mode != 'diamond':
+        # interior switches outside the diamond have no transit rules, so ARP packets are forwarded along the paths
+        port = interior_arp_port(event.dpid, event.port)
+        if port is not None:
+            send_messages(event.dpid, [packet_out(event.ofp, port)], PRIORITY_BULK)
+    interior_packet_in(event, data)
+
+
+def interior_packet_in(event, data):
+    # an ARP or IP packet shows that the transit rules are missing; the probes leave them to the shadow table
+    if not proactive_mode:
+        install_static_rules(event.dpid, missing=data[12:14] in ('\x08\x06', '\x08\x00'))
+
+
+def register_packet_in_handlers(dpid):
+    # handlers of the PACKET_IN messages of the switch by EtherType (None: any other EtherType), see _handle_PacketIn()
+    for key in [key for key in packet_in_handlers if key[0] == dpid]:
+        del packet_in_handlers[key]
+    if dpid == ingress_switch:
+        handlers = {0x5577: probe_in, 0x0806: ingress_arp_in, 0x0800: ingress_ip_in}
+    elif dpid == egress_switch:
+        handlers = {0x5577: probe_in, 0x0806: egress_arp_in, None: egress_packet_in}
+    else:
+        handlers = {0x5577: probe_in, 0x0806: interior_arp_in, None: interior_packet_in}  # 0x5577: EtherType of the probes
+    for ethertype, handler in handlers.iteritems():
+        packet_in_handlers[(dpid, ethertype)] = handler
 
-        msg = of.ofp_flow_mod()
-        msg.priority = 100
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.dl_type = 0x0800
-        msg.match.nw_dst = "10.0.0.4"
-        msg.actions.append(of.ofp_action_output(port=4))
-        event.connection.send(msg)
 
-        msg = of.ofp_flow_mod()
-        msg.priority = 100
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.dl_type = 0x0800
-        msg.match.nw_dst = "10.0.0.5"
-        msg.actions.append(of.ofp_action_output(port=5))
-        event.connection.send(msg)
-
-        msg = of.ofp_flow_mod()
-        msg.priority = 100
-        msg.idle_timeout = 0
-        msg.hard_timeout = 0
-        msg.match.dl_type = 0x0800
-        msg.match.nw_dst = "10.0.0.6"
-        msg.actions.append(of.ofp_action_output(port=6))
-        event.connection.send(msg)
+def _handle_PacketIn(event):
+    # fast path: the handler is looked up by the DPID and the EtherType read from the raw frame, and it decodes only the
+    # fields it needs (event.parsed, which parses the whole packet, is not used)
+    data = event.data
+    if len(data) < 14:
+        return
+    ethertype, = struct.unpack_from('!H', data, 12)
+    handler = packet_in_handlers.get((event.dpid, ethertype))
+    if handler is None:
+        handler = packet_in_handlers.get((event.dpid, None))
+    if handler is not None:
+        handler(event, data)
+
+
+def _handle_FlowRemoved(event):
+    # the s1 entry of an unspecified flow has expired (the flow went idle): the flow and its s5 entry are removed as well;
+    # the same for the s1 entry of a sub-flow in the multipath mode.
+    # An entry removed by a delete of the controller (e.g. an unspecified flow taken over by an intent) is already gone
+    # from its state, and its message may come after a new entry of the same match and priority has been installed;
+    # so is the message of an entry whose idle timeout differs from the one of the shadow table (replaced meanwhile)
+    if event.ofp.reason == of.OFPRR_DELETE:
+        return
+    match = event.ofp.match
+    entry = match_entry(match, event.ofp.priority)
+    table = flow_tables.get(event.dpid)
+    if table is not None:
+        if entry in table and table[entry][0] != event.ofp.idle_timeout:
+            return
+        table.pop(entry, None)
+    if event.dpid != s1_dpid:
+        return
+    key = (ip_hosts.get(match.nw_src), ip_hosts.get(match.nw_dst))
+    if event.ofp.priority == subflow_priority:
+        transaction = FlowModTransaction('expiry')
+        remove_subflow(key, (match.nw_proto, match.tp_src, match.tp_dst), transaction)
+        transaction.commit()
+        return
+    if key in other_intents:
+        transaction = FlowModTransaction('expiry')
+        remove_unspecified_flow(key, transaction)
+        transaction.commit()
+        print "Unspecified flow expired: ", key, "; unspecified flows: ", len(other_intents)
+
+
+def _handle_BarrierIn(event):
+    # a barrier reply confirms that the switch has applied the flow mods of a transaction sent before the barrier request
+    transaction = pending_barriers.pop((event.dpid, event.xid), None)
+    if transaction is not None:
+        transaction.barrier_replied(event.dpid, event.xid)
 
 
 # As usually, launch() is the function called by POX to initialize the component (routing_controller.py in our case)
 # indicated by a parameter provided to pox.py
 
-def launch():
-    global start_time
+def launch(probe='round_robin', probe_period=1, routing_period=4,
+           estimator='last', history=16, alpha=0.25, percentile=90, proactive=False,
+           margin=0, dwell=0, gain=0, max_reroutes=0, placement='flows', max_flows=1000, idle_timeout=10,
+           latency='portstats', port_stats_period=5,
+           max_probe_period=8, max_probe_rate=0, probe_jitter=5, probe_slack=10,
+           solver='greedy', solver_budget=50, move_cost=1, path_capacity=0, topology='diamond', paths=3,
+           backup=False, arp='forward', message_rate=0, message_burst=100, multipath=False, link_rate=10,
+           forecast=False, forecast_level=0.5, forecast_trend=0.3, forecast_bound=1, path_delay='first_hop',
+           path_margin=10, probe_limits=''):
+    # probe: 'round_robin' (one path per tick, routing every fourth tick), 'concurrent' (all paths in every tick)
+    #     or 'adaptive' (each path with a period between probe_period and max_probe_period [s]; max_probe_rate [probes/s]
+    #     limits all paths together, 0 disables it; probe_jitter [ms] and probe_slack [ms] set how fast the period shrinks;
+    #     probe_limits sets the periods of single paths as path:min:max [s], e.g. --probe_limits=s2:1:4,s4:2:16)
+    # probe_period: measurement cadence [s]; routing_period: routing cadence [s] (used by the concurrent probing only)
+    # estimator: link delay used by the routing - 'last' sample, 'ewma', 'median' or 'percentile' of the last history samples
+    # alpha: weight of a new sample in the EWMA; percentile: percentile used by the 'percentile' estimator
+    # forecast: route on the upper bound of a linear trend forecast of the delays for the next routing cycle when it is higher
+    #     than the estimate; forecast_level and forecast_trend weight the level and the trend, forecast_bound [standard deviations]
+    #     sets the bound
+    # proactive: push the static rules on ConnectionUp instead of on packet_in
+    # arp: 'forward' the ARP packets, answer the requests for learned hosts from the controller ('proxy'), or also install
+    #     ARP rules towards the local hosts in the edge switches ('proactive')
+    # margin [ms], dwell [s], gain [ms], max_reroutes: stability policy of the rerouting (see hold_route(), 0 disables a limit)
+    # placement: balance the candidate paths by the number of 'flows' or by the 'load' measured on the s1 ports
+    # max_flows: maximum number of unspecified flows; idle_timeout [s]: inactivity after which an unspecified flow expires (0: never)
+    # solver: 'greedy' placement or 'mcf' (the greedy placement rebalanced as a min-cost flow within solver_budget [ms],
+    #     move_cost per moved flow, at most path_capacity flows per path, 0: no limit; its moves follow the stability policy,
+    #     and it only balances the number of flows, so it cannot be used with the 'load' placement)
+    # topology: the 'diamond' of the lab or the links found by openflow.discovery ('discovery', launch openflow.discovery too);
+    #     paths: number of shortest paths between s1 and s5 which are measured and used by the routing; with discovery they are
+    #     computed again in every routing cycle, and replace the current ones when their delays are lower by path_margin [ms]
+    # backup: keep a backup path for each route, to which it is moved when its path goes down (see fail_over())
+    # message_rate: flow mods and packet-outs per second to a switch (0: no limit) with bursts of message_burst; the messages
+    #     above it are queued, the routing changes before the installs of new flows
+    # multipath: split each intent into sub-flows (IP protocol and transport ports) spread over all its candidate paths,
+    #     weighted by their spare capacity out of link_rate [Mbit/s] (see new_subflow())
+    # path_delay: delay of a path used by the routing - the S1-SX link only ('first_hop'), or the sum of all its links probed
+    #     in both directions, from s1 to s5 ('oneway') or for the round trip ('rtt')
+    # latency: control channel latency from 'portstats' requests or 'echo' requests; port_stats_period [s]: port stats poll in the echo mode
+    # e.g.: ./pox.py routing_controller --probe=concurrent --probe_period=0.5 --routing_period=1 --estimator=median --proactive
+    global start_time, probe_mode, probe_interval, routing_interval, routing_ticks
+    global link_delay, delay_estimator, delay_percentile, proactive_mode
+    global reroute_margin, reroute_dwell, reroute_gain, reroute_limit, placement_mode
+    global max_other_intents, flow_idle_timeout, latency_mode, port_stats_interval
+    global max_probe_interval, probe_rate_limit, probe_jitter_limit, probe_slack_limit, path_probe_limits
+    global solver_mode, solver_time_budget, flow_move_cost, max_path_flows
+    global topology_mode, max_paths, history_size, history_alpha, backup_mode, arp_mode
+    global message_rate_limit, message_burst_size, multipath_mode, link_capacity
+    global forecast_mode, forecast_alpha, forecast_beta, forecast_z, path_delay_mode, path_change_margin
     start_time = time.time() * 1000 * 10  # factor *10 applied to increase the accuracy for short delays (capture tenths of ms)
     print "start_time:", start_time / 10
 
+    if probe not in ('round_robin', 'concurrent', 'adaptive'):
+        raise RuntimeError("Unknown probe mode: %s" % (probe,))
+    probe_mode = probe
+    probe_interval = float(probe_period)
+    routing_interval = float(routing_period)
+    routing_ticks = max(1, int(round(routing_interval / probe_interval)))
+    print "probe mode:", probe_mode, "; probe period:", probe_interval, "[s]; routing period:", routing_interval, "[s]"
+    max_probe_interval = max(probe_interval, float(max_probe_period))
+    probe_rate_limit = float(max_probe_rate)
+    probe_jitter_limit = float(probe_jitter)
+    probe_slack_limit = float(probe_slack)
+    path_probe_limits = {}
+    for limit in [limit for limit in str(probe_limits).split(',') if limit.strip()]:
+        fields = limit.strip().split(':')
+        if len(fields) != 3:
+            raise RuntimeError("Probe limits of a path are path:min:max, not: %s" % (limit,))
+        # the probes go with the timer ticks, so a period is at least probe_period
+        min_period = max(probe_interval, float(fields[1]))
+        path_probe_limits[fields[0]] = (min_period, max(min_period, float(fields[2])))
+    if probe_mode == 'adaptive':
+        print "max probe period:", max_probe_interval, "[s]; max probe rate:", probe_rate_limit, "[probes/s]; jitter:", probe_jitter_limit, "[ms]; slack:", probe_slack_limit, "[ms]"
+        if path_probe_limits:
+            print "probe periods of single paths [s]:", ", ".join(["%s %s-%s" % (path, limits[0], limits[1]) for path, limits in sorted(path_probe_limits.items())])
+
+    if estimator not in ('last', 'ewma', 'median', 'percentile'):
+        raise RuntimeError("Unknown delay estimator: %s" % (estimator,))
+    delay_estimator = estimator
+    delay_percentile = float(percentile)
+    history_size = int(history)
+    if history_size < 1:
+        raise RuntimeError("The delay history needs at least one sample: %s" % (history,))
+    history_alpha = float(alpha)
+    forecast_mode = str_to_bool(forecast)
+    forecast_alpha = float(forecast_level)
+    forecast_beta = float(forecast_trend)
+    forecast_z = float(forecast_bound)
+    link_delay = {}
+    for path in measured_paths:
+        link_delay[path] = DelayHistory(history_size, history_alpha, forecast_alpha, forecast_beta)
+    print "delay estimator:", delay_estimator, "; history:", int(history), "samples"
+    if forecast_mode:
+        print "delay forecast: level weight", forecast_alpha, "; trend weight", forecast_beta, "; bound:", forecast_z, "standard deviations"
+
+    if latency not in ('portstats', 'echo'):
+        raise RuntimeError("Unknown control latency: %s" % (latency,))
+    latency_mode = latency
+    port_stats_interval = float(port_stats_period)
+    print "control latency:", latency_mode, "; port stats period:", port_stats_interval, "[s]"
+    if path_delay not in ('first_hop', 'oneway', 'rtt'):
+        raise RuntimeError("Unknown path delay: %s" % (path_delay,))
+    path_delay_mode = path_delay
+    print "path delay:", path_delay_mode
+
+    proactive_mode = str_to_bool(proactive)
+    if arp not in ('forward', 'proxy', 'proactive'):
+        raise RuntimeError("Unknown ARP mode: %s" % (arp,))
+    arp_mode = arp
+    compile_tables()
+
+    if topology not in ('diamond', 'discovery'):
+        raise RuntimeError("Unknown topology: %s" % (topology,))
+    topology_mode = topology
+    max_paths = max(1, int(paths))
+    path_change_margin = float(path_margin)
+    adjacency.clear()
+    if topology_mode == 'diamond':
+        for a, port_a, b, port_b in diamond_links:
+            adjacency.setdefault(a, {})[b] = port_a
+            adjacency.setdefault(b, {})[a] = port_b
+        update_paths()
+    else:
+        set_paths([])  # the paths are computed as the links are discovered
+    backup_mode = str_to_bool(backup)
+    print "topology:", topology_mode, "; paths:", max_paths, "; backup paths:", backup_mode
+
+    reroute_margin = float(margin)
+    reroute_dwell = float(dwell)
+    reroute_gain = float(gain)
+    reroute_limit = int(max_reroutes)
+    print "reroute margin:", reroute_margin, "[ms]; dwell:", reroute_dwell, "[s]; gain:", reroute_gain, "[ms]; max reroutes:", reroute_limit
+
+    if placement not in ('flows', 'load'):
+        raise RuntimeError("Unknown placement: %s" % (placement,))
+    placement_mode = placement
+    multipath_mode = str_to_bool(multipath)
+    link_capacity = float(link_rate) * 1e6
+    print "placement:", placement_mode, "; multipath:", multipath_mode, "; link rate:", link_capacity / 1e6, "[Mbit/s]"
+
+    if solver not in ('greedy', 'mcf'):
+        raise RuntimeError("Unknown solver: %s" % (solver,))
+    if solver == 'mcf' and placement_mode == 'load':
+        # the costs of the solver count the flows of a path, it cannot balance flows of different rates
+        raise RuntimeError("The mcf solver balances the number of flows, it cannot be used with the 'load' placement")
+    solver_mode = solver
+    solver_time_budget = float(solver_budget) / 1000
+    flow_move_cost = float(move_cost)
+    max_path_flows = int(path_capacity)
+    print "solver:", solver_mode, "; budget:", solver_time_budget * 1000, "[ms]; move cost:", flow_move_cost, "; path capacity:", max_path_flows
+
+    max_other_intents = max(1, int(max_flows))
+    flow_idle_timeout = int(idle_timeout)
+    message_rate_limit = float(message_rate)
+    message_burst_size = max(1, int(message_burst))
+    if message_rate_limit > 0:
+        Timer(min(0.1, max(0.01, 1 / message_rate_limit)), drain_message_queues, recurring=True)
+    print "message rate limit:", message_rate_limit, "[1/s]; burst:", message_burst_size
+
+    print "unspecified flows: at most", max_other_intents, "; idle timeout:", flow_idle_timeout, "[s]"
+    print "proactive static rules:", proactive_mode, "; ARP:", arp_mode
+
     # core is an instance of class POXCore (EventMixin) and it can register objects.
     # An object with name xxx can be registered to core instance which makes this object become a "component" available as pox.core.core.xxx.
     # for examples see e.g. https://noxrepo.github.io/pox-doc/html/#the-openflow-nexus-core-openflow
@@ -839,6 +2515,17 @@ def launch():
                                     _handle_ConnectionUp)  # listen for the establishment of a new control channel with a switch, https://noxrepo.github.io/pox-doc/html/#connectionup
     core.openflow.addListenerByName("PacketIn",
                                     _handle_PacketIn)  # listen for the reception of packet_in message from switch, https://noxrepo.github.io/pox-doc/html/#packetin
-    # core.openflow.addListenerByName("FlowStatsReceived",
-    #                                 _handle_flowstats_received)
+    core.openflow.addListenerByName("FlowRemoved",
+                                    _handle_FlowRemoved)  # listen for expired flow entries of unspecified flows
+    core.openflow.addListenerByName("BarrierIn",
+                                    _handle_BarrierIn)  # listen for barrier replies confirming flow mod transactions
+    core.openflow.addListenerByName("FlowStatsReceived",
+                                    _handle_flowstats_received)  # listen for flow stats, used to measure the rates of the flows
+    core.openflow.addListenerByName("PortStatus",
+                                    _handle_PortStatus)  # listen for ports going down or up, https://noxrepo.github.io/pox-doc/html/#portstatus
+    core.openflow.addListenerByName("ConnectionDown",
+                                    _handle_ConnectionDown)  # listen for disconnected switches
+    if topology_mode == 'discovery':
+        # links found by openflow.discovery, https://noxrepo.github.io/pox-doc/html/#openflow-discovery-discovering-inter-switch-links
+        core.call_when_ready(lambda: core.openflow_discovery.addListenerByName("LinkEvent", _handle_LinkEvent), "openflow_discovery")
 
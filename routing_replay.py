@@ -0,0 +1,288 @@
+# Offline replay of the controller without Mininet: the switches of the diamond topology are simulated on top of the POX
+# libraries (no root access or tc needed), the time of the controller is simulated as well, so a trace runs in seconds.
+# The simulated switches:
+#    - connect to the controller (ConnectionUp) with the port names of the Mininet topology,
+#    - answer barrier, port stats, flow stats and echo requests after the control channel delay,
+#    - forward the probes sent by s1 to the middle switch of their path after the delay of the S1-SX link given by the trace,
+#      where they come back to the controller in a PACKET_IN; the probes of the links (path_delay 'oneway' or 'rtt') go from
+#      any switch to its neighbour, the S1-SX links have the delay of the trace in both directions, the SX-S5 links none
+#      (as in routing_net.py).
+# The trace is a list of [S1-S2, S1-S3, S1-S4] delays, each of them applied for step seconds, by default the schedule of
+# change_delays() in routing_net.py. The report gives per step the routing cycles, the flow mods sent, the reroutes,
+# the convergence time (from the delay change to the last routing change of the step) and the intents whose path
+# does not meet their delay bound at the end of the step, together with the decision latency of intent_routing().
+# e.g. (with the POX directory in PYTHONPATH):
+#    python2 routing_replay.py --option probe=concurrent --option estimator=median --step 10
+
+import sys
+import os
+import json
+import heapq
+import random
+import struct
+import argparse
+import timeit
+
+import pox.openflow.libopenflow_01 as of
+from pox.core import core
+
+import routing_controller as rc
+
+# delays of the S1-S2, S1-S3 and S1-S4 links [ms] of change_delays() in routing_net.py
+test_delays = [[200, 50, 10],
+               [50, 40, 60],
+               [400, 5, 100],
+               [2, 500, 40]]
+
+switch_names = ['s1', 's2', 's3', 's4', 's5']
+
+
+class SimClock(object):
+    """
+    SimClock replaces the time module of the controller; the callbacks scheduled on it run in the order of their times
+    """
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+        self.queue = []
+        self.seq = 0  # keeps the callbacks scheduled for the same time in their order
+
+    def time(self):
+        return self.now
+
+    def schedule(self, delay, callback, *args):
+        self.seq += 1
+        heapq.heappush(self.queue, (self.now + delay, self.seq, callback, args))
+
+    def run(self, until):
+        while self.queue and self.queue[0][0] <= until:
+            when, seq, callback, args = heapq.heappop(self.queue)
+            self.now = when
+            callback(*args)
+        self.now = until
+
+
+class SimTimer(object):
+    """
+    SimTimer replaces the recoco Timer of the controller with a timer of the simulated clock
+    """
+
+    def __init__(self, timeToWake, callback, recurring=False):
+        self.interval = timeToWake
+        self.callback = callback
+        self.recurring = recurring
+        clock.schedule(self.interval, self.expire)
+
+    def expire(self):
+        self.callback()
+        if self.recurring:
+            clock.schedule(self.interval, self.expire)
+
+
+class Event(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class SimPort(object):
+    def __init__(self, name, port_no):
+        self.name = name
+        self.port_no = port_no
+
+
+class SimConnection(object):
+    """
+    SimConnection is the connection of a simulated switch: the messages sent by the controller are counted and answered
+    """
+
+    def __init__(self, dpid, name):
+        self.dpid = dpid
+        self.name = name
+        self.features = Event(ports=[SimPort('%s-eth%d' % (name, port_no), port_no) for port_no in range(1, 7)])
+        self.handlers = [None] * (of.OFPT_BARRIER_REPLY + 1)  # OpenFlow handler table, see hook_echo_reply()
+        self.flow_mods = 0
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        # a single send() may carry several messages (see FlowModTransaction)
+        while len(data) >= 8:
+            length, = struct.unpack('!H', data[2:4])
+            receive(self, data[:length])
+            data = data[length:]
+
+
+class SimNexus(object):
+    """
+    SimNexus stands in for core.openflow: it keeps the listeners of the controller and the connections of the switches
+    """
+
+    def __init__(self):
+        self.listeners = {}
+        self.connections = {}
+
+    def addListenerByName(self, name, handler):
+        self.listeners.setdefault(name, []).append(handler)
+
+    def getConnection(self, dpid):
+        return self.connections.get(dpid)
+
+    def raise_event(self, name, event):
+        for handler in self.listeners.get(name, []):
+            handler(event)
+
+
+clock = SimClock()
+nexus = SimNexus()
+control_delay = 0.001  # [s] one-way delay of the control channel
+control_jitter = 0.0  # [s]
+link_delays = test_delays[0]  # current delays of the S1-S2, S1-S3 and S1-S4 links [ms]
+
+
+def channel_delay():
+    return control_delay + random.uniform(0, control_jitter)
+
+
+def receive(connection, msg):
+    # a message of the controller arrives at the switch; the replies are delivered after the control channel round trip
+    msg_type = ord(msg[1:2])
+    xid, = struct.unpack('!I', msg[4:8])
+    if msg_type == of.OFPT_FLOW_MOD:
+        connection.flow_mods += 1
+    elif msg_type == of.OFPT_BARRIER_REQUEST:
+        event = Event(connection=connection, dpid=connection.dpid, xid=xid)
+        clock.schedule(channel_delay() + channel_delay(), nexus.raise_event, 'BarrierIn', event)
+    elif msg_type == of.OFPT_ECHO_REQUEST:
+        clock.schedule(channel_delay() + channel_delay(), echo_reply, connection, msg[8:])
+    elif msg_type == of.OFPT_STATS_REQUEST:
+        stats_type, = struct.unpack('!H', msg[8:10])
+        if stats_type == of.OFPST_PORT:
+            stats = [of.ofp_port_stats(port_no=port.port_no) for port in connection.features.ports]
+            event = Event(connection=connection, dpid=connection.dpid, ofp=Event(xid=xid), stats=stats)
+            clock.schedule(channel_delay() + channel_delay(), nexus.raise_event, 'PortStatsReceived', event)
+        elif stats_type == of.OFPST_FLOW:
+            event = Event(connection=connection, dpid=connection.dpid, ofp=Event(xid=xid), stats=[])
+            clock.schedule(channel_delay() + channel_delay(), nexus.raise_event, 'FlowStatsReceived', event)
+    elif msg_type == of.OFPT_PACKET_OUT:
+        forward_probe(connection, msg)
+
+
+def echo_reply(connection, body):
+    handler = connection.handlers[of.OFPT_ECHO_REPLY]
+    if handler is not None:
+        handler(connection, of.ofp_echo_reply(body=body))
+
+
+def forward_probe(connection, msg):
+    # a probe sent out of a switch towards its neighbour reaches the controller in a PACKET_IN of the neighbour
+    actions_len, = struct.unpack('!H', msg[14:16])
+    data = msg[16 + actions_len:]
+    if actions_len < 8 or len(data) < 14 or struct.unpack('!H', data[12:14])[0] != 0x5577:
+        return
+    port, = struct.unpack('!H', msg[20:22])
+    for neighbour, neighbour_port in rc.adjacency.get(connection.dpid, {}).items():
+        if neighbour_port == port:
+            middle = neighbour if connection.dpid == rc.ingress_switch else connection.dpid
+            link = link_delays[middle - 2] if rc.ingress_switch in (connection.dpid, neighbour) else 0.0  # s2 has the DPID 2
+            target = nexus.connections[neighbour]
+            in_port = rc.adjacency[neighbour][connection.dpid]
+            event = Event(connection=target, dpid=target.dpid, port=in_port, data=data,
+                          ofp=of.ofp_packet_in(in_port=in_port, data=data))
+            delay = channel_delay() + link / 1000.0 + channel_delay()
+            clock.schedule(delay, nexus.raise_event, 'PacketIn', event)
+
+
+def parse_trace(name):
+    # JSON list of [S1-S2, S1-S3, S1-S4] delays, given in ms as numbers or as the strings of tc (e.g. "200ms")
+    with open(name) as f:
+        trace = json.load(f)
+    return [[float(str(delay).replace('ms', '')) for delay in delays] for delays in trace]
+
+
+def main():
+    global control_delay, control_jitter, link_delays
+
+    parser = argparse.ArgumentParser(description="Replays a delay trace against routing_controller with simulated switches")
+    parser.add_argument('--trace', help="JSON file with the [S1-S2, S1-S3, S1-S4] delays [ms] of each step (default: change_delays())")
+    parser.add_argument('--step', type=float, default=10.0, help="duration of a step of the trace [s] (default 10)")
+    parser.add_argument('--repeat', type=int, default=1, help="number of times the trace is replayed (default 1)")
+    parser.add_argument('--control_delay', type=float, default=1.0, help="one-way delay of the control channel [ms] (default 1)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum random addition to the control delay [ms] (default 0)")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the control jitter")
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                        help="option of routing_controller.launch(), e.g. probe=concurrent (repeatable)")
+    parser.add_argument('--verbose', action='store_true', help="keep the output of the controller")
+    args = parser.parse_args()
+
+    trace = parse_trace(args.trace) if args.trace else test_delays
+    trace = trace * max(1, args.repeat)
+    control_delay = args.control_delay / 1000.0
+    control_jitter = args.jitter / 1000.0
+    random.seed(args.seed)
+    options = dict(option.split('=', 1) for option in args.option)
+
+    # the controller runs on the simulated clock and with the simulated OpenFlow nexus
+    rc.time = clock
+    rc.Timer = SimTimer
+    core.register('openflow', nexus)
+
+    decision_times = []
+    changes = []  # simulated times of the routing changes
+    reroutes = [0]
+    routing = rc.intent_routing
+
+    def timed_routing():
+        before = dict((key, route['path']) for key, route in rc.current_routing.iteritems())
+        started = timeit.default_timer()
+        routing()
+        decision_times.append(timeit.default_timer() - started)
+        moved = [key for key, route in rc.current_routing.iteritems() if before.get(key, route['path']) != route['path']]
+        new = [key for key in rc.current_routing if key not in before]
+        reroutes[0] += len(moved)
+        if moved or new:
+            changes.append(clock.now)
+
+    rc.intent_routing = timed_routing
+
+    stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    report = []
+    try:
+        rc.launch(**options)
+        for index, name in enumerate(switch_names):
+            connection = SimConnection(index + 1, name)
+            nexus.connections[connection.dpid] = connection
+            nexus.raise_event('ConnectionUp', Event(connection=connection, dpid=connection.dpid))
+
+        for delays in trace:
+            link_delays = delays
+            start = clock.now
+            cycles, flow_mods, moved = len(decision_times), sum([c.flow_mods for c in nexus.connections.values()]), reroutes[0]
+            clock.run(start + args.step)
+            step_changes = [when for when in changes if when > start]
+            violations = 0
+            for intent in rc.intents:
+                route = rc.current_routing.get((intent['source'], intent['destination']))
+                if route is None or delays[rc.measured_paths.index(route['path'])] > intent['delay']:
+                    violations += 1
+            report.append((delays, len(decision_times) - cycles,
+                           sum([c.flow_mods for c in nexus.connections.values()]) - flow_mods, reroutes[0] - moved,
+                           step_changes[-1] - start if step_changes else None, violations))
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+    print "%-22s %8s %10s %9s %16s %11s" % ("delays [ms]", "cycles", "flow mods", "reroutes", "convergence [s]", "violations")
+    for delays, cycles, flow_mods, moved, convergence, violations in report:
+        print "%-22s %8d %10d %9d %16s %11d" % ("/".join(["%g" % delay for delay in delays]), cycles, flow_mods, moved,
+                                               "-" if convergence is None else "%.1f" % convergence, violations)
+    if decision_times:
+        print "decision latency: mean", round(sum(decision_times) / len(decision_times) * 1000, 3), "[ms]; max", \
+            round(max(decision_times) * 1000, 3), "[ms] over", len(decision_times), "routing cycles"
+    print "flow mods:", sum([c.flow_mods for c in nexus.connections.values()]), "; reroutes:", reroutes[0]
+
+
+if __name__ == '__main__':
+    main()